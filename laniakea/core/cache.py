@@ -0,0 +1,79 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Persistent cache of API responses which expire after a time-to-live."""
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('laniakea')
+
+
+class JSONCache:
+    """
+    Thread-safe cache of JSON serializable values which is stored in a single file.
+
+    Cloud APIs do not send validators such as ETags for the cached resources, hence entries simply expire after
+    a time-to-live.
+    """
+
+    def __init__(self, path, ttl=86400, refresh=False):
+        """
+        :param path: Location of the cache file.
+        :type path: str
+        :param ttl: Seconds after which a cached value is requested again.
+        :type ttl: int
+        :param refresh: Ignore all cached entries and request them again.
+        :type refresh: bool
+        """
+        self.path = path
+        self.ttl = ttl
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as fo:
+                return json.load(fo)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, key, ttl=None):
+        """Return a fresh cached value or None.
+
+        :param key: Key of the value.
+        :type key: str
+        :param ttl: Time-to-live of this value if different from the default.
+        :type ttl: int
+        :return: The cached value.
+        """
+        if self.refresh:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or time.time() - entry['time'] >= (self.ttl if ttl is None else ttl):
+            return None
+        return entry['data']
+
+    def update(self, values):
+        """Store values and write the cache to disk.
+
+        :param values: The values by key.
+        :type values: dict
+        """
+        now = time.time()
+        with self.lock:
+            for key, data in values.items():
+                self.entries[key] = {'data': data, 'time': now}
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+                with open(temp_path, 'w', encoding='utf-8') as fo:
+                    json.dump(self.entries, fo, sort_keys=True)
+                os.replace(temp_path, self.path)
+            except OSError as msg:
+                logger.warning('Unable to write cache %s: %s', self.path, msg)
@@ -0,0 +1,146 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Bounded concurrent execution of operations against many cloud resources."""
+import logging
+import threading
+import concurrent.futures
+
+from laniakea.core.retry import TokenBucket
+
+logger = logging.getLogger('laniakea')
+
+
+class OperationReport:
+    """Thread-safe collection of the outcome of an operation applied to many resources.
+    """
+
+    def __init__(self, operation=None):
+        """
+        :param operation: Name of the operation, used for logging.
+        :type operation: str
+        """
+        self.operation = operation
+        self.succeeded = []
+        self.results = []
+        self.failed = []
+        self.skipped = []
+        self.lock = threading.Lock()
+
+    def success(self, item, result=None):
+        """Record a resource for which the operation succeeded.
+
+        :param item: The resource.
+        :param result: Return value of the operation.
+        """
+        with self.lock:
+            self.succeeded.append(item)
+            self.results.append(result)
+
+    def failure(self, item, error):
+        """Record a resource for which the operation failed.
+
+        :param item: The resource.
+        :param error: The raised exception or a description of the failure.
+        """
+        with self.lock:
+            self.failed.append((item, error))
+
+    def skip(self, item, reason):
+        """Record a resource which was left untouched.
+
+        :param item: The resource.
+        :param reason: Why the resource was skipped.
+        :type reason: str
+        """
+        with self.lock:
+            self.skipped.append((item, reason))
+
+    @property
+    def failed_items(self):
+        """The resources for which the operation failed.
+
+        :rtype: list
+        """
+        return [item for item, _ in self.failed]
+
+    def summary(self):
+        """Describe the outcome in a single line.
+
+        :rtype: str
+        """
+        return '%s: %d succeeded, %d failed, %d skipped' % (
+            self.operation or 'operation', len(self.succeeded), len(self.failed), len(self.skipped))
+
+    def __bool__(self):
+        return not self.failed
+
+
+class BoundedExecutor:
+    """Apply an operation to many resources with a bounded amount of workers and an optional rate limit.
+
+    Each call of the operation may be wrapped in a :class:`RetryPolicy`. An operation which raises or returns
+    `False` is recorded as failed, so that a single failure does not affect the remaining resources.
+    """
+
+    def __init__(self, max_workers=32, rate=None, retry=None):
+        """
+        :param max_workers: Maximum amount of concurrent calls.
+        :type max_workers: int
+        :param rate: Maximum amount of calls started per second, unlimited if None.
+        :type rate: float
+        :param retry: Policy used to retry failed calls.
+        :type retry: :class:`RetryPolicy`
+        """
+        self.max_workers = max_workers
+        self.rate = rate
+        self.retry = retry
+
+    def run(self, func, items, skip=None, operation=None):
+        """Call a function for each item and wait for all calls to finish.
+
+        :param func: Function which is called with a single item.
+        :type func: function
+        :param items: Resources to apply the function to.
+        :type items: list
+        :param skip: Callback which returns a reason for leaving an item untouched or None.
+        :type skip: function
+        :param operation: Name of the operation, used for logging.
+        :type operation: str
+        :return: Outcome for each item.
+        :rtype: :class:`OperationReport`
+        """
+        report = OperationReport(operation)
+        bucket = TokenBucket(self.rate) if self.rate else None
+
+        def worker(item):
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                result = self.retry(func, item) if self.retry is not None else func(item)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error('%s failed for %s: %s', operation or getattr(func, '__name__', func),
+                             getattr(item, 'name', item), error)
+                report.failure(item, error)
+                return
+            if result is False:
+                report.failure(item, 'Operation returned False')
+            else:
+                report.success(item, result)
+
+        pending = []
+        for item in items:
+            reason = skip(item) if skip is not None else None
+            if reason:
+                report.skip(item, reason)
+            else:
+                pending.append(item)
+
+        if pending:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as pool:
+                for future in [pool.submit(worker, item) for item in pending]:
+                    future.result()
+
+        logger.debug(report.summary())
+        return report
@@ -10,9 +10,12 @@ import argparse
 
 import boto.exception
 
+from laniakea.core.cache import JSONCache
 from laniakea.core.common import Focus, String
+from laniakea.core.ssh import SSHExecutor
 from laniakea.core.userdata import UserData
-from .manager import EC2Manager, EC2ManagerException
+from .manager import EC2ManagerException
+from .pool import EC2RegionPool
 
 logger = logging.getLogger('laniakea')
 
@@ -118,6 +121,23 @@ class Ec2CommandLine:
                        type=str,
                        help='Custom image arguments.')
 
+        o.add_argument('-image-cache',
+                       metavar='path',
+                       type=str,
+                       default=os.path.join(dirs.user_cache_dir, 'ec2', 'images.json'),
+                       help='Cache of resolved AMI names.')
+
+        o.add_argument('-image-cache-ttl',
+                       metavar='#',
+                       type=int,
+                       default=86400,
+                       help='Seconds until a cached AMI name is resolved again.')
+
+        o.add_argument('-refresh-image-cache',
+                       action='store_true',
+                       default=False,
+                       help='Resolve all AMI names again and update the cache.')
+
         o.add_argument('-profile',
                        metavar='str',
                        type=str,
@@ -130,15 +150,40 @@ class Ec2CommandLine:
                        default=0.05,
                        help='Max price for spot instances.')
 
+        o.add_argument('-target-capacity',
+                       metavar='#',
+                       type=int,
+                       default=None,
+                       help='Fill this capacity with spot instances of the "instance_types" of the image definition.')
+
+        o.add_argument('-fallback-timeout',
+                       metavar='#',
+                       type=int,
+                       default=300,
+                       help='Seconds until unfulfilled spot requests fall back to the next instance type.')
+
+        o.add_argument('-timeout',
+                       metavar='#',
+                       type=int,
+                       default=600,
+                       help='Seconds to wait for on-demand instances to become ready.')
+
         o.add_argument('-region',
                        type=str,
-                       default='us-west-2',
-                       help='EC2 region name.')
+                       nargs='+',
+                       default=['us-west-2'],
+                       help='EC2 region names or "all".')
 
         o.add_argument('-zone',
                        type=str,
                        default=None,
-                       help='EC2 placement zone.')
+                       help='EC2 placement zone or "auto" to spread spot instances across the cheapest zones.')
+
+        o.add_argument('-max-zones',
+                       metavar='#',
+                       type=int,
+                       default=3,
+                       help='Maximum amount of zones used by "-zone auto".')
 
         o.add_argument('-root-device-type',
                        type=str,
@@ -162,6 +207,18 @@ class Ec2CommandLine:
                        default=False,
                        help='Delete the root EBS volume on termination.')
 
+        o.add_argument('-run-concurrency',
+                       metavar='#',
+                       type=int,
+                       default=32,
+                       help='Maximum amount of hosts executing -run at the same time.')
+
+        o.add_argument('-run-timeout',
+                       metavar='#',
+                       type=int,
+                       default=300,
+                       help='Seconds until -run is aborted on a host.')
+
         o.add_argument('-version',
                        action='version',
                        version='%(prog)s {}'.format(cls.VERSION),
@@ -191,14 +248,18 @@ class Ec2CommandLine:
 
         logger.info('Using Boto configuration profile "%s"', Focus.info(args.profile))
 
-        if args.zone:
+        if args.zone and args.zone != 'auto':
             for image_name in images:
                 images[image_name]['placement'] = args.zone
 
-        cluster = EC2Manager(images)
+        if (args.create_on_demand or args.create_spot) and (len(args.region) > 1 or 'all' in args.region):
+            logger.error('Instances can only be created in a single region.')
+            return 1
+
+        cluster = EC2RegionPool(images, JSONCache(args.image_cache, args.image_cache_ttl, args.refresh_image_cache))
         try:
-            cluster.connect(profile_name=args.profile, region=args.region)
-        except EC2ManagerException as msg:
+            cluster.connect(args.region, profile_name=args.profile)
+        except (EC2ManagerException, boto.exception.EC2ResponseError) as msg:
             logger.error(msg)
             return 1
 
@@ -209,42 +270,64 @@ class Ec2CommandLine:
                                          args.root_device_type,
                                          args.ebs_size,
                                          args.ebs_volume_type,
-                                         args.ebs_volume_delete_on_termination)
-            except boto.exception.EC2ResponseError as msg:
+                                         args.ebs_volume_delete_on_termination,
+                                         timeout=args.timeout)
+            except (EC2ManagerException, boto.exception.EC2ResponseError) as msg:
                 logger.error(msg)
                 return 1
 
         if args.create_spot:
             try:
-                cluster.create_spot(args.max_spot_price,
-                                    args.image_name,
-                                    args.tags,
-                                    args.root_device_type,
-                                    args.ebs_size,
-                                    args.ebs_volume_type,
-                                    args.ebs_volume_delete_on_termination)
-            except boto.exception.EC2ResponseError as msg:
+                if args.target_capacity:
+                    cluster.create_spot_capacity(args.max_spot_price,
+                                                 args.target_capacity,
+                                                 args.image_name,
+                                                 args.tags,
+                                                 args.root_device_type,
+                                                 args.ebs_size,
+                                                 args.ebs_volume_type,
+                                                 args.ebs_volume_delete_on_termination,
+                                                 fallback_timeout=args.fallback_timeout,
+                                                 placement=args.zone,
+                                                 max_zones=args.max_zones)
+                else:
+                    cluster.create_spot(args.max_spot_price,
+                                        args.image_name,
+                                        args.tags,
+                                        args.root_device_type,
+                                        args.ebs_size,
+                                        args.ebs_volume_type,
+                                        args.ebs_volume_delete_on_termination,
+                                        placement=args.zone,
+                                        max_zones=args.max_zones)
+            except (EC2ManagerException, boto.exception.EC2ResponseError) as msg:
                 logger.error(msg)
                 return 1
 
         if args.stop:
             try:
-                cluster.stop(cluster.find(filters=args.only), int(args.stop))
+                report = cluster.stop(list(cluster.iter_instances(filters=args.only, projection=True)),
+                                      int(args.stop))
             except boto.exception.EC2ResponseError as msg:
                 logger.error(msg)
                 return 1
+            if report.failed:
+                return 1
 
         if args.terminate:
             try:
-                cluster.terminate(cluster.find(filters=args.only), int(args.terminate))
+                report = cluster.terminate(list(cluster.iter_instances(filters=args.only, projection=True)),
+                                           int(args.terminate))
             except boto.exception.EC2ResponseError as msg:
                 logger.error(msg)
                 return 1
+            if report.failed:
+                return 1
 
         if args.status:
             try:
-                for i in cluster.find(filters=args.only):
-                    logger.info('%s is %s at %s - tags: %s', i.id, i.state, i.ip_address, i.tags)
+                for i in cluster.iter_instances(filters=args.only, projection=True):
+                    logger.info('%s is %s at %s in %s - tags: %s', i.id, i.state, i.ip_address, i.region, i.tags)
             except boto.exception.EC2ResponseError as msg:
                 logger.error(msg)
                 return 1
@@ -269,11 +352,23 @@ class Ec2CommandLine:
             logger.info('Bucketing available instances.')
             hosts = []
             try:
-                for host in cluster.find(filters=args.only):
-                    hosts.append(host)
+                for host in cluster.iter_instances(filters=args.only, projection=True):
+                    if host.state == 'running' and host.ip_address:
+                        hosts.append(host.ip_address)
             except boto.exception.EC2ResponseError as msg:
                 logger.error(msg)
                 return 1
             logger.info('Executing remote commands on %d instances.', len(hosts))
 
+            executor = SSHExecutor(username, identity,
+                                   concurrency=args.run_concurrency,
+                                   timeout=args.run_timeout,
+                                   options=ssh.get('options'))
+            summary = executor.summarize(executor.run(hosts, args.run))
+            for returncode, count in sorted(summary.items(), key=lambda item: str(item[0])):
+                logger.info('%d host/s %s.', count,
+                            'failed to run the command' if returncode is None else 'exited with %d' % returncode)
+            if set(summary) - {0}:
+                return 1
+
         return 0
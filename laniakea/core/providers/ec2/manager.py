@@ -6,10 +6,14 @@
 import collections
 import datetime
 import logging
+import random
 import ssl
 import sys
 import time
 
+from laniakea.core.retry import ErrorClass, RetryPolicy, TokenBucket
+from .planner import SpotPricePlanner
+
 logger = logging.getLogger('laniakea')
 
 try:
@@ -24,35 +28,65 @@ class EC2ManagerException(Exception):
     """Exception class for Azure Manager."""
 
 
+EC2_THROTTLING_ERRORS = frozenset(['Throttling', 'RequestLimitExceeded'])
+# Resources which were just created are not necessarily visible to all endpoints yet.
+EC2_TRANSIENT_ERRORS = frozenset(['InternalError', 'Unavailable', 'ServiceUnavailable',
+                                  'InvalidInstanceID.NotFound', 'InvalidSpotInstanceRequestID.NotFound'])
+EC2_API_BUCKET = TokenBucket(rate=20, capacity=100)
+
+# Compact projection of an instance used for listing large fleets.
+InstanceRecord = collections.namedtuple('InstanceRecord',
+                                        ['id', 'state', 'ip_address', 'launch_time', 'tags', 'region'])
+
+
+def classify_ec2_error(error):
+    """Classify errors raised by boto for the retry policy of EC2Manager.
+
+    :param error: The raised exception.
+    :type error: Exception
+    :return: An ErrorClass value.
+    :rtype: str
+    """
+    if isinstance(error, ssl.SSLError):
+        return ErrorClass.TRANSIENT
+    if isinstance(error, boto.exception.EC2ResponseError):
+        if error.error_code in EC2_THROTTLING_ERRORS:
+            return ErrorClass.THROTTLED
+        if error.error_code in EC2_TRANSIENT_ERRORS or (error.status or 0) >= 500:
+            return ErrorClass.TRANSIENT
+    return ErrorClass.FATAL
+
+
 class EC2Manager:
     """
     Amazon Elastic Cloud Computing manager class.
     """
-
-    def __init__(self, images):
+    TAG_BATCH_SIZE = 500
+    FIND_PAGE_SIZE = 500
+    # Keys of an image definition which are interpreted by Laniakea and not passed on to boto.
+    IMAGE_OPTIONS = frozenset(['root_size', 'root_device', 'instance_types', 'image_name'])
+    # Instances in these states will never enter the running state on their own.
+    INSTANCE_FAILED_STATES = frozenset(['shutting-down', 'terminated', 'stopping', 'stopped'])
+
+    def __init__(self, images, image_cache=None):
         self.ec2 = None
         self.images = images
+        self.image_cache = image_cache
         self.remote_images = {}
+        self.spot_planner = SpotPricePlanner(self)
+        self.retry_policy = RetryPolicy(classify_ec2_error, bucket=EC2_API_BUCKET)
 
     def retry_on_ec2_error(self, func, *args, **kwargs):
         """
         Call the given method with the given arguments, retrying if the call
-        failed due to an EC2ResponseError. This method will wait at most 30
-        seconds and perform up to 6 retries. If the method still fails, it will
-        propagate the error.
+        failed due to a throttling or transient EC2ResponseError or SSLError.
+        Retries back off exponentially according to `retry_policy`, all other
+        errors are propagated immediately.
 
         :param func: Function to call
         :type func: function
         """
-        exception_retry_count = 6
-        while True:
-            try:
-                return func(*args, **kwargs)
-            except (boto.exception.EC2ResponseError, ssl.SSLError) as msg:
-                exception_retry_count -= 1
-                if exception_retry_count <= 0:
-                    raise msg
-                time.sleep(5)
+        return self.retry_policy(func, *args, **kwargs)
 
     def connect(self, region, **kw_params):
         """Connect to a EC2.
@@ -67,11 +101,6 @@ class EC2Manager:
             raise EC2ManagerException('Unable to connect to region "%s"' % region)
         self.remote_images.clear()
 
-        if self.images and any(('image_name' in img and 'image_id' not in img) for img in self.images.values()):
-            for img in self.images.values():
-                if 'image_name' in img and 'image_id' not in img:
-                    img['image_id'] = self.resolve_image_name(img.pop('image_name'))
-
     def resolve_image_name(self, image_name):
         """Look up an AMI for the connected region based on an image name.
 
@@ -80,20 +109,63 @@ class EC2Manager:
         :return: The AMI for the given image.
         :rtype: str
         """
+        return self.resolve_image_names([image_name])[image_name]
+
+    def resolve_image_names(self, image_names):
+        """Look up AMIs for the connected region based on image names.
+
+        Names are looked up in the image cache first. The remaining names are resolved with a single
+        query per owner scope and stored in the cache.
+
+        :param image_names: The names of the images to resolve.
+        :type image_names: iterable
+        :return: The AMIs by image name.
+        :rtype: dict
+        """
+        region = self.ec2.region.name
+        missing = set(image_names) - set(self.remote_images)
+        if self.image_cache is not None:
+            for name in list(missing):
+                image_id = self.image_cache.get('%s/%s' % (region, name))
+                if image_id is not None:
+                    self.remote_images[name] = image_id
+                    missing.discard(name)
+
         # look at each scope in order of size
         scopes = ['self', 'amazon', 'aws-marketplace', None]
-        if image_name in self.remote_images:
-            return self.remote_images[image_name]
+        resolved = {}
         for scope in scopes:
+            if not missing:
+                break
             logger.info('Retrieving available AMIs owned by %s...', scope)
             if scope is not None:
-                remote_images = self.ec2.get_all_images(owners=[scope], filters={'name': image_name})
+                remote_images = self.retry_on_ec2_error(self.ec2.get_all_images,
+                                                        owners=[scope], filters={'name': sorted(missing)})
             else:
-                remote_images = self.ec2.get_all_images(filters={'name': image_name})
-            self.remote_images.update({ri.name: ri.id for ri in remote_images})
-            if image_name in self.remote_images:
-                return self.remote_images[image_name]
-        raise EC2ManagerException('Failed to resolve AMI name "%s" to an AMI' % image_name)
+                remote_images = self.retry_on_ec2_error(self.ec2.get_all_images, filters={'name': sorted(missing)})
+            for remote_image in remote_images:
+                if remote_image.name in missing:
+                    resolved[remote_image.name] = remote_image.id
+            missing -= set(resolved)
+        self.remote_images.update(resolved)
+
+        if self.image_cache is not None and resolved:
+            self.image_cache.update({'%s/%s' % (region, name): image_id for name, image_id in resolved.items()})
+
+        if missing:
+            raise EC2ManagerException('Failed to resolve AMI name "%s" to an AMI' % '", "'.join(sorted(missing)))
+        return {name: self.remote_images[name] for name in image_names}
+
+    def create_tags(self, resource_ids, tags):
+        """Assign the same tags to many resources with as few requests as possible.
+
+        :param resource_ids: A list of resource ids to tag.
+        :type resource_ids: list
+        :param tags:
+        :type tags: dict
+        """
+        for offset in range(0, len(resource_ids), self.TAG_BATCH_SIZE):
+            self.retry_on_ec2_error(self.ec2.create_tags, resource_ids[offset:offset + self.TAG_BATCH_SIZE], tags)
 
     def create_on_demand(self,
                          instance_type='default',
@@ -101,7 +173,9 @@ class EC2Manager:
                          root_device_type='ebs',
                          size='default',
                          vol_type='gp2',
-                         delete_on_termination=False):
+                         delete_on_termination=False,
+                         timeout=None,
+                         callback=None):
         """Create one or more EC2 on-demand instances.
 
         :param size: Size of root device
@@ -116,37 +190,71 @@ class EC2Manager:
         :type instance_type: str
         :param tags:
         :type tags: dict
+        :param timeout: Seconds to wait for the instances to become ready.
+        :type timeout: int
+        :param callback: Called with each instance as soon as it is running.
+        :type callback: function
         :return: List of instances created
         :rtype: list
         """
-        name, size = self._get_default_name_size(instance_type, size)
-
-        if root_device_type == 'ebs':
-            self.images[instance_type]['block_device_map'] = \
-                self._configure_ebs_volume(vol_type, name, size, delete_on_termination)
-
-        reservation = self.ec2.run_instances(**self.images[instance_type])
+        params = self._launch_params(instance_type, root_device_type, size, vol_type, delete_on_termination)
+        reservation = self.ec2.run_instances(**params)
 
-        logger.info('Creating requested tags...')
-        for i in reservation.instances:
-            self.retry_on_ec2_error(self.ec2.create_tags, [i.id], tags or {})
+        if tags:
+            logger.info('Creating requested tags...')
+            self.create_tags([i.id for i in reservation.instances], tags)
 
         instances = []
         logger.info('Waiting for instances to become ready...')
-        while len(reservation.instances): # pylint: disable=len-as-condition
-            for i in reservation.instances:
-                if i.state == 'running':
-                    instances.append(i)
-                    reservation.instances.pop(reservation.instances.index(i))
-                    logger.info('%s is %s at %s (%s)',
-                                i.id,
-                                i.state,
-                                i.public_dns_name,
-                                i.ip_address)
-                else:
-                    self.retry_on_ec2_error(i.update)
+        for i in self.wait_for_instances(reservation.instances, timeout=timeout):
+            if callback is not None:
+                callback(i)
+            instances.append(i)
         return instances
 
+    def wait_for_instances(self, instances, timeout=None, poll_interval=5.0):
+        """Wait for instances to enter the running state and yield them as they do.
+
+        The state of all pending instances is retrieved with a single request per poll. Instances which are shutting
+        down, terminated or stopped are dropped with a warning.
+
+        :param instances: A list of instances.
+        :type instances: list
+        :param timeout: Seconds to wait before giving up on the remaining instances.
+        :type timeout: int
+        :param poll_interval: Seconds between two polls.
+        :type poll_interval: float
+        :return: Generator of running boto.ec2.instance.Instance's.
+        :rtype: generator
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = collections.OrderedDict((i.id, i) for i in instances)
+        while pending:
+            for i in [i for i in pending.values() if i.state in self.INSTANCE_FAILED_STATES]:
+                del pending[i.id]
+                logger.warning('%s is %s and will not become ready.', i.id, i.state)
+
+            for i in [i for i in pending.values() if i.state == 'running']:
+                del pending[i.id]
+                logger.info('%s is %s at %s (%s)',
+                            i.id,
+                            i.state,
+                            i.public_dns_name,
+                            i.ip_address)
+                yield i
+
+            if not pending:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning('%d instance/s did not become ready in time: %s',
+                               len(pending), ', '.join(pending.keys()))
+                break
+
+            time.sleep(poll_interval)
+            for i in self.find(instance_ids=list(pending.keys())):
+                if i.id in pending:
+                    pending[i.id] = i
+
     def create_spot_requests(self,
                              price,
                              instance_type='default',
@@ -154,7 +262,10 @@ class EC2Manager:
                              size='default',
                              vol_type='gp2',
                              delete_on_termination=False,
-                             timeout=None):
+                             timeout=None,
+                             placement=None,
+                             count=None,
+                             ec2_instance_type=None):
         """Request creation of one or more EC2 spot instances.
 
         :param size:
@@ -168,20 +279,23 @@ class EC2Manager:
         :type instance_type: str
         :param timeout: Seconds to keep the request open (cancelled if not fulfilled).
         :type timeout: int
+        :param placement: Availability zone overriding the one of the image definition.
+        :type placement: str
+        :param count: Amount of instances overriding the one of the image definition.
+        :type count: int
+        :param ec2_instance_type: EC2 instance type overriding the one of the image definition.
+        :type ec2_instance_type: str
         :return: List of requests created
         :rtype: list
         """
-        name, size = self._get_default_name_size(instance_type, size)
-
-        if root_device_type == 'ebs':
-            self.images[instance_type]['block_device_map'] = \
-                self._configure_ebs_volume(vol_type, name, size, delete_on_termination)
+        params = self._launch_params(instance_type, root_device_type, size, vol_type, delete_on_termination,
+                                     placement=placement, count=count, instance_type=ec2_instance_type)
 
         valid_until = None
         if timeout is not None:
             valid_until = (datetime.datetime.now() + datetime.timedelta(seconds=timeout)).isoformat()
 
-        requests = self.ec2.request_spot_instances(price, valid_until=valid_until, **self.images[instance_type])
+        requests = self.ec2.request_spot_instances(price, valid_until=valid_until, **params)
         return [r.id for r in requests]
 
     def check_spot_requests(self, requests, tags=None):
@@ -196,6 +310,7 @@ class EC2Manager:
         :rtype: list
         """
         instances = [None] * len(requests)
+        positions = {req_id: idx for idx, req_id in enumerate(requests)}
         ec2_requests = self.retry_on_ec2_error(self.ec2.get_all_spot_instance_requests, request_ids=requests)
         successes_by_id = collections.OrderedDict()
 
@@ -209,7 +324,7 @@ class EC2Manager:
 
             elif req.state != "open":
                 # return the request so we don't try again
-                instances[requests.index(req.id)] = req
+                instances[positions[req.id]] = req
 
         if successes_by_id:
             ec2_instances = self.retry_on_ec2_error(self.ec2.get_only_instances, list(successes_by_id.keys()))
@@ -220,10 +335,10 @@ class EC2Manager:
                                              ', '.join(successes_by_id.values())))
 
             if tags:
-                self.retry_on_ec2_error(self.ec2.create_tags, [instance.id for instance in ec2_instances], tags)
+                self.create_tags([instance.id for instance in ec2_instances], tags)
 
-            for req_id, instance in zip(successes_by_id.values(), ec2_instances):
-                instances[requests.index(req_id)] = instance
+            for instance in ec2_instances:
+                instances[positions[successes_by_id[instance.id]]] = instance
                 logger.info('%s is %s at %s (%s)',
                             instance.id,
                             instance.state,
@@ -243,6 +358,55 @@ class EC2Manager:
         for req in ec2_requests:
             req.cancel()
 
+    def fulfill_spot_requests(self, request_ids, tags=None, timeout=None, min_interval=1.0, max_interval=30.0):
+        """Wait for fulfillment of EC2 spot instance requests and yield instances as they become available.
+
+        Only requests which are still open are polled again. The delay between two polls grows exponentially
+        (with jitter) while nothing happens and falls back to `min_interval` once a request got fulfilled.
+
+        :param request_ids: List of EC2 spot instance request IDs.
+        :type request_ids: list
+        :param tags:
+        :type tags: dict
+        :param timeout: Seconds to wait before cancelling the still open requests.
+        :type timeout: int
+        :param min_interval: Shortest delay between two polls in seconds.
+        :type min_interval: float
+        :param max_interval: Longest delay between two polls in seconds.
+        :type max_interval: float
+        :return: Generator of fulfilled boto.ec2.instance.Instance's.
+        :rtype: generator
+        """
+        pending = list(request_ids)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = min_interval
+        while pending:
+            delay = random.uniform(interval / 2, interval)
+            if deadline is not None:
+                delay = max(0, min(delay, deadline - time.monotonic()))
+            time.sleep(delay)
+
+            still_open = []
+            for request_id, result in zip(pending, self.check_spot_requests(pending, tags=tags)):
+                if result is None:
+                    still_open.append(request_id)
+                elif isinstance(result, boto.ec2.instance.Instance):
+                    yield result
+                elif result.status.code == 'bad-parameters':
+                    logger.error('Spot request for "%s" failed due to bad parameters.', result.id)
+                    self.cancel_spot_requests([result.id])
+
+            if len(still_open) < len(pending):
+                interval = min_interval
+            else:
+                interval = min(interval * 2, max_interval)
+            pending = still_open
+
+            if pending and deadline is not None and time.monotonic() >= deadline:
+                logger.warning('Cancelling %d unfulfilled spot request/s.', len(pending))
+                self.cancel_spot_requests(pending)
+                break
+
     def create_spot(self,
                     price,
                     instance_type='default',
@@ -251,7 +415,10 @@ class EC2Manager:
                     size='default',
                     vol_type='gp2',
                     delete_on_termination=False,
-                    timeout=None):
+                    timeout=None,
+                    callback=None,
+                    placement=None,
+                    max_zones=3):
         """Create one or more EC2 spot instances.
 
         :param root_device_type:
@@ -265,47 +432,130 @@ class EC2Manager:
         :type instance_type: str
         :param tags:
         :type tags: dict
+        :param callback: Called with each instance as soon as its request is fulfilled.
+        :type callback: function
+        :param placement: Availability zone, or "auto" to spread the instances across the cheapest zones.
+        :type placement: str
+        :param max_zones: Maximum amount of zones to spread the instances across.
+        :type max_zones: int
         :return: List of instances created
         :rtype: list
         """
-        request_ids = self.create_spot_requests(price,
-                                                instance_type=instance_type,
-                                                root_device_type=root_device_type,
-                                                size=size,
-                                                vol_type=vol_type,
-                                                delete_on_termination=delete_on_termination)
+        request_ids = self._request_spot_placements(price, instance_type, placement, max_zones,
+                                                   root_device_type=root_device_type,
+                                                   size=size,
+                                                   vol_type=vol_type,
+                                                   delete_on_termination=delete_on_termination)
         instances = []
         logger.info('Waiting on fulfillment of requested spot instances.')
-        poll_resolution = 5.0
-        time_exceeded = False
-        while request_ids:
-            time.sleep(poll_resolution)
-
-            new_instances = self.check_spot_requests(request_ids, tags=tags)
-
-            if timeout is not None:
-                timeout -= poll_resolution
-                time_exceeded = timeout <= 0
-
-            fulfilled = []
-            for idx, instance in enumerate(new_instances):
-                if instance.status.code == "bad-parameters":
-                    logging.error('Spot request for "%s" failed due to bad parameters.', instance.id)
-                    self.cancel_spot_requests([instance.id])
-                if instance is not None:
-                    fulfilled.append(idx)
-                if isinstance(instance, boto.ec2.instance.Instance):
-                    instances.append(instance)
-            for idx in reversed(fulfilled):
-                request_ids.pop(idx)
-
-            if request_ids and time_exceeded:
-                self.cancel_spot_requests(request_ids)
-                break
+        for instance in self.fulfill_spot_requests(request_ids, tags=tags, timeout=timeout):
+            if callback is not None:
+                callback(instance)
+            instances.append(instance)
+
+        return instances
+
+    def create_spot_capacity(self,
+                             price,
+                             target_capacity,
+                             instance_type='default',
+                             tags=None,
+                             root_device_type='ebs',
+                             size='default',
+                             vol_type='gp2',
+                             delete_on_termination=False,
+                             fallback_timeout=300,
+                             callback=None,
+                             placement=None,
+                             max_zones=3):
+        """Fill a target capacity with spot instances of the interchangeable instance types of an image definition.
 
+        The "instance_types" list of the image definition ranks the interchangeable types, each with a "weight",
+        i.e. its vCPU count, and an optional "max_price". Starting with the first type, as many instances as
+        needed for the remaining capacity are requested. Requests which stay unfulfilled for `fallback_timeout`
+        seconds are cancelled and the remaining capacity falls back to the next type.
+
+        :param price: Max price to pay for spot instance per hour.
+        :type price: float
+        :param target_capacity: Total weight of the instances to create.
+        :type target_capacity: int
+        :param instance_type: A section name in amazon.json
+        :type instance_type: str
+        :param tags:
+        :type tags: dict
+        :param fallback_timeout: Seconds to wait for the requests of one instance type.
+        :type fallback_timeout: int
+        :param callback: Called with each instance as soon as its request is fulfilled.
+        :type callback: function
+        :param placement: Availability zone, or "auto" to spread the instances across the cheapest zones.
+        :type placement: str
+        :param max_zones: Maximum amount of zones to spread the instances across.
+        :type max_zones: int
+        :return: List of instances created
+        :rtype: list
+        """
+        image = self.images[instance_type]
+        pools = image.get('instance_types') or [{'instance_type': image['instance_type'], 'weight': 1}]
+        instances = []
+        capacity = 0
+        for pool in pools:
+            weight = pool.get('weight', 1)
+            count = -(-(target_capacity - capacity) // weight)
+            if count <= 0:
+                break
+            logger.info('Requesting %d spot instance/s of type %s for a remaining capacity of %d.',
+                        count, pool['instance_type'], target_capacity - capacity)
+            try:
+                request_ids = self._request_spot_placements(pool.get('max_price', price), instance_type,
+                                                           placement, max_zones,
+                                                           count=count,
+                                                           ec2_instance_type=pool['instance_type'],
+                                                           root_device_type=root_device_type,
+                                                           size=size,
+                                                           vol_type=vol_type,
+                                                           delete_on_termination=delete_on_termination)
+            except EC2ManagerException as msg:
+                logger.warning('Skipping instance type %s: %s', pool['instance_type'], msg)
+                continue
+            for instance in self.fulfill_spot_requests(request_ids, tags=tags, timeout=fallback_timeout):
+                capacity += weight
+                if callback is not None:
+                    callback(instance)
+                instances.append(instance)
+
+        if capacity < target_capacity:
+            logger.warning('Fulfilled a capacity of %d out of %d.', capacity, target_capacity)
         return instances
 
-    def _scale_down(self, instances, count):
+    def _request_spot_placements(self, price, instance_type, placement, max_zones, count=None, **kwargs):
+        """Request spot instances in a single zone or, with placement "auto", spread across the cheapest zones.
+
+        :return: List of requests created
+        :rtype: list
+        """
+        if placement == 'auto':
+            image = self.images[instance_type]
+            ec2_instance_type = kwargs.get('ec2_instance_type') or image['instance_type']
+            plan = self.spot_planner.plan(ec2_instance_type, count or image.get('count', 1), price, max_zones)
+            if not plan:
+                raise EC2ManagerException('No availability zone offers "%s" for less than %s'
+                                          % (ec2_instance_type, price))
+            logger.info('Spreading spot requests across zones: %s',
+                        ', '.join('%s=%d' % (zone, zone_count) for zone, zone_count in plan.items()))
+        else:
+            plan = {placement: count}
+
+        request_ids = []
+        for zone, zone_count in plan.items():
+            request_ids.extend(self.create_spot_requests(price,
+                                                         instance_type=instance_type,
+                                                         placement=zone,
+                                                         count=zone_count,
+                                                         **kwargs))
+        return request_ids
+
+    @staticmethod
+    def _scale_down(instances, count):
         """Return a list of |count| last created instances by launch time.
 
         :param instances: A list of instances.
@@ -336,15 +586,31 @@ class EC2Manager:
         :return: Root device name and size
         :rtype: tuple(str, int)
         """
-        if 'root_size' in self.images[instance_type]:
-            size = self.images[instance_type].pop('root_size')
+        image = self.images[instance_type]
+        return image.get('root_device', '/dev/sda1'), image.get('root_size', size)
 
-        if 'root_device' in self.images[instance_type]:
-            name = self.images[instance_type].pop('root_device')
-        else:
-            name = '/dev/sda1'
+    def _launch_params(self, section, root_device_type, size, vol_type, delete_on_termination, **overrides):
+        """Build the boto launch arguments of an image definition without modifying the definition.
+
+        An "image_name" of the definition is resolved to an AMI of the connected region, as AMI names are region
+        specific.
 
-        return name, size
+        :param section: A section name in amazon.json.
+        :type section: str
+        :param overrides: Launch arguments which take precedence over the image definition, unless None.
+        :type overrides: dict
+        :return: Keyword arguments for run_instances or request_spot_instances.
+        :rtype: dict
+        """
+        name, size = self._get_default_name_size(section, size)
+        image = self.images[section]
+        params = {k: v for k, v in image.items() if k not in self.IMAGE_OPTIONS}
+        if 'image_name' in image and 'image_id' not in image:
+            params['image_id'] = self.resolve_image_name(image['image_name'])
+        if root_device_type == 'ebs':
+            params['block_device_map'] = self._configure_ebs_volume(vol_type, name, size, delete_on_termination)
+        params.update((k, v) for k, v in overrides.items() if v is not None)
+        return params
 
     def _configure_ebs_volume(self, vol_type, name, size, delete_on_termination):
         """Sets the desired root EBS size, otherwise the default EC2 value is used.
@@ -404,8 +670,36 @@ class EC2Manager:
         :return: A flattened list of filtered instances.
         :rtype: list
         """
-        instances = []
-        reservations = self.retry_on_ec2_error(self.ec2.get_all_instances, instance_ids=instance_ids, filters=filters)
-        for reservation in reservations:
-            instances.extend(reservation.instances)
-        return instances
+        return list(self.iter_instances(instance_ids=instance_ids, filters=filters))
+
+    def iter_instances(self, instance_ids=None, filters=None, projection=False):
+        """Yield instances page by page while following the NextToken of the API.
+
+        :param instance_ids: A list of instance ids to filter by
+        :type instance_ids: list
+        :param filters: A dict of Filter.N values defined in http://goo.gl/jYNej9
+        :type filters: dict
+        :param projection: Yield compact InstanceRecord's instead of boto instances.
+        :type projection: bool
+        :return: Generator of filtered instances.
+        :rtype: generator
+        """
+        # EC2 does not allow to combine pagination with a list of instance ids.
+        max_results = None if instance_ids else self.FIND_PAGE_SIZE
+        next_token = None
+        while True:
+            reservations = self.retry_on_ec2_error(self.ec2.get_all_reservations,
+                                                   instance_ids=instance_ids,
+                                                   filters=filters,
+                                                   max_results=max_results,
+                                                   next_token=next_token)
+            for reservation in reservations:
+                for i in reservation.instances:
+                    if projection:
+                        yield InstanceRecord(i.id, i.state, i.ip_address, i.launch_time, dict(i.tags),
+                                             self.ec2.region.name)
+                    else:
+                        yield i
+            next_token = getattr(reservations, 'next_token', None)
+            if not next_token:
+                break
@@ -0,0 +1,107 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Spot price based placement of EC2 spot instances"""
+import collections
+import datetime
+import statistics
+import time
+
+
+class SpotPricePlanner:
+    """
+    Ranks the availability zones of a region by spot price and volatility and spreads launches across them.
+    """
+
+    def __init__(self, manager, history=6 * 3600, ttl=300, product_description='Linux/UNIX'):
+        """
+        :param manager: A connected EC2Manager.
+        :type manager: EC2Manager
+        :param history: Seconds of spot price history to consider.
+        :type history: int
+        :param ttl: Seconds to keep fetched price histories.
+        :type ttl: int
+        :param product_description: Product of which the spot prices are considered.
+        :type product_description: str
+        """
+        self.manager = manager
+        self.history = history
+        self.ttl = ttl
+        self.product_description = product_description
+        self.cache = {}
+
+    def price_history(self, instance_type):
+        """Return the spot prices of an instance type in all zones of the region.
+
+        :param instance_type: An EC2 instance type, i.e. c5.2xlarge
+        :type instance_type: str
+        :return: List of (timestamp, price) tuples, oldest first, by zone.
+        :rtype: dict
+        """
+        cached = self.cache.get(instance_type)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+
+        start_time = (datetime.datetime.utcnow() - datetime.timedelta(seconds=self.history)).isoformat()
+        prices = collections.defaultdict(list)
+        next_token = None
+        while True:
+            history = self.manager.retry_on_ec2_error(self.manager.ec2.get_spot_price_history,
+                                                      start_time=start_time,
+                                                      instance_type=instance_type,
+                                                      product_description=self.product_description,
+                                                      next_token=next_token)
+            for entry in history:
+                prices[entry.availability_zone].append((entry.timestamp, entry.price))
+            next_token = getattr(history, 'next_token', None)
+            if not next_token:
+                break
+
+        for zone_prices in prices.values():
+            zone_prices.sort()
+        self.cache[instance_type] = (time.monotonic(), dict(prices))
+        return self.cache[instance_type][1]
+
+    def rank(self, instance_type, max_price):
+        """Rank the zones in which the current spot price is within budget.
+
+        Zones are ordered by mean price plus standard deviation over the history, which favours cheap zones
+        with a calm price and therefore fewer interruptions.
+
+        :param instance_type: An EC2 instance type, i.e. c5.2xlarge
+        :type instance_type: str
+        :param max_price: Max price to pay for spot instance per hour.
+        :type max_price: float
+        :return: List of (zone, current price, score) tuples, best first.
+        :rtype: list
+        """
+        ranking = []
+        for zone, history in self.price_history(instance_type).items():
+            prices = [price for _, price in history]
+            if not prices or prices[-1] > max_price:
+                continue
+            ranking.append((zone, prices[-1], statistics.mean(prices) + statistics.pstdev(prices)))
+        return sorted(ranking, key=lambda rank: (rank[2], rank[1]))
+
+    def plan(self, instance_type, count, max_price, max_zones=3):
+        """Split a number of instances evenly across the best ranked zones.
+
+        :param instance_type: An EC2 instance type, i.e. c5.2xlarge
+        :type instance_type: str
+        :param count: Amount of instances to launch.
+        :type count: int
+        :param max_price: Max price to pay for spot instance per hour.
+        :type max_price: float
+        :param max_zones: Maximum amount of zones to use.
+        :type max_zones: int
+        :return: Amount of instances by zone, empty if no zone is within budget.
+        :rtype: OrderedDict
+        """
+        zones = [zone for zone, _, _ in self.rank(instance_type, max_price)[:max_zones]]
+        plan = collections.OrderedDict()
+        for idx, zone in enumerate(zones):
+            share = count // len(zones) + (1 if idx < count % len(zones) else 0)
+            if share:
+                plan[zone] = share
+        return plan
@@ -0,0 +1,188 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Fan-out of EC2 operations across many regions"""
+import collections
+import concurrent.futures
+import copy
+import logging
+import queue
+import sys
+
+from laniakea.core.executor import BoundedExecutor
+from .manager import EC2Manager, EC2ManagerException
+
+logger = logging.getLogger('laniakea')
+
+try:
+    import boto.ec2
+except ImportError as msg:
+    logger.error(msg)
+    sys.exit(-1)
+
+
+class EC2RegionPool:
+    """
+    Pool of EC2Manager connections which fans out operations across many regions in parallel.
+    """
+    # Partitions which require separate credentials.
+    EXCLUDED_REGION_PREFIXES = ('cn-', 'us-gov-')
+
+    def __init__(self, images, image_cache=None, max_workers=None):
+        self.images = images
+        self.image_cache = image_cache
+        self.max_workers = max_workers
+        self.managers = collections.OrderedDict()
+
+    @classmethod
+    def all_regions(cls):
+        """Return the names of all known EC2 regions.
+
+        :return: List of region names.
+        :rtype: list
+        """
+        return sorted(r.name for r in boto.ec2.regions() if not r.name.startswith(cls.EXCLUDED_REGION_PREFIXES))
+
+    def connect(self, regions, **kw_params):
+        """Connect to each of the given regions.
+
+        :param regions: A list of region names or ['all'].
+        :type regions: list
+        :param kw_params:
+        :type kw_params: dict
+        """
+        if 'all' in regions:
+            regions = self.all_regions()
+        self.managers.clear()
+        for region in regions:
+            self.managers[region] = EC2Manager(copy.deepcopy(self.images), self.image_cache)
+
+        def connect(region):
+            self.managers[region].connect(region, **kw_params)
+        report = self._map(connect, self.managers, operation='connect')
+        if report.failed:
+            raise EC2ManagerException('Unable to connect to %s: %s' % (
+                ', '.join(region for region, _ in report.failed), report.failed[0][1]))
+
+    def _map(self, func, regions, operation=None):
+        """Run a function for each region in a thread pool, a failing region does not affect the others.
+
+        :param func: Function called with the region name.
+        :type func: function
+        :param regions: Region names.
+        :type regions: iterable
+        :param operation: Name of the operation, used for logging.
+        :type operation: str
+        :return: Regions with the results of the function.
+        :rtype: :class:`OperationReport`
+        """
+        regions = list(regions)
+        return BoundedExecutor(self.max_workers or len(regions) or 1).run(func, regions, operation=operation)
+
+    def _merge(self, method, *args, **kwargs):
+        report = self._map(lambda region: getattr(self.managers[region], method)(*args, **kwargs), self.managers,
+                           operation=method)
+        if report.failed:
+            logger.warning('%s failed in %s', method, ', '.join(region for region, _ in report.failed))
+        merged = []
+        for result in report.results:
+            merged.extend(result)
+        return merged
+
+    def _single(self):
+        """Return the manager of the only connected region.
+
+        Instances are only created in a single region: AMIs and placements are specific to a region and
+        the requested amount of instances would otherwise be launched in each region.
+        """
+        if len(self.managers) != 1:
+            raise EC2ManagerException('Instances can only be created in a single region, not in: %s'
+                                      % ', '.join(self.managers))
+        return next(iter(self.managers.values()))
+
+    @staticmethod
+    def _region_of(instance):
+        region = instance.region
+        return getattr(region, 'name', region)
+
+    def create_on_demand(self, *args, **kwargs):
+        """Run EC2Manager.create_on_demand in the connected region and return the created instances."""
+        return self._single().create_on_demand(*args, **kwargs)
+
+    def create_spot(self, *args, **kwargs):
+        """Run EC2Manager.create_spot in the connected region and return the created instances."""
+        return self._single().create_spot(*args, **kwargs)
+
+    def create_spot_capacity(self, *args, **kwargs):
+        """Run EC2Manager.create_spot_capacity in the connected region and return the created instances."""
+        return self._single().create_spot_capacity(*args, **kwargs)
+
+    def find(self, instance_ids=None, filters=None):
+        """Run EC2Manager.find in every region and return all found instances."""
+        return self._merge('find', instance_ids=instance_ids, filters=filters)
+
+    def iter_instances(self, instance_ids=None, filters=None, projection=False):
+        """Yield instances of all regions as soon as any of the regions returned a page.
+
+        :param instance_ids: A list of instance ids to filter by
+        :type instance_ids: list
+        :param filters: A dict of Filter.N values defined in http://goo.gl/jYNej9
+        :type filters: dict
+        :param projection: Yield compact InstanceRecord's instead of boto instances.
+        :type projection: bool
+        :return: Generator of filtered instances.
+        :rtype: generator
+        """
+        done = object()
+        results = queue.Queue()
+
+        def produce(region):
+            try:
+                for instance in self.managers[region].iter_instances(instance_ids, filters, projection):
+                    results.put(instance)
+            finally:
+                results.put(done)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers or len(self.managers) or 1) as executor:
+            futures = [executor.submit(produce, region) for region in self.managers]
+            remaining = len(futures)
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                else:
+                    yield item
+            for future in futures:
+                future.result()
+
+    def _apply(self, method, instances, count):
+        if count > 0:
+            instances = EC2Manager._scale_down(instances, count)  # pylint: disable=protected-access
+        by_region = collections.defaultdict(list)
+        for i in instances:
+            by_region[self._region_of(i)].append(i)
+        return self._map(lambda region: getattr(self.managers[region], method)(by_region[region]), by_region,
+                         operation=method)
+
+    def stop(self, instances, count=0):
+        """Stop the provided instances in their respective regions.
+
+        :param count: Stop only the |count| last created instances across all regions.
+        :param instances: A list of instances.
+        :type instances: list
+        :return: Outcome for each region.
+        :rtype: :class:`OperationReport`
+        """
+        return self._apply('stop', instances, count)
+
+    def terminate(self, instances, count=0):
+        """Terminate the provided instances in their respective regions.
+
+        :param count: Terminate only the |count| last created instances across all regions.
+        :param instances: A list of instances.
+        :type instances: list
+        :return: Outcome for each region.
+        :rtype: :class:`OperationReport`
+        """
+        return self._apply('terminate', instances, count)
@@ -10,7 +10,9 @@ import argparse
 
 from laniakea.core.common import Focus, Common
 from laniakea.core.userdata import UserData
-from .manager import ComputeEngineManager, ComputeEngineManagerException, Kurz
+from .filters import Kurz
+from .manager import ComputeEngineManager, ComputeEngineManagerException, GoogleBaseError
+from .reconciler import PoolReconciler
 
 logger = logging.getLogger('laniakea')
 
@@ -54,6 +56,10 @@ class GceCommandLine:
                        action='store_true',
                        help='Terminate instances.')
 
+        g.add_argument('-reconcile',
+                       action='store_true',
+                       help='Keep -count instances of a -pool alive and replace preempted instances.')
+
         o = parser.add_argument_group('Optional Parameters')  # pylint: disable=invalid-name
         o.add_argument('-conf',
                        metavar='path',
@@ -79,6 +85,34 @@ class GceCommandLine:
                        default='us-east1-b',
                        help='Where the instance is going to run. "all" for some operations.')
 
+        o.add_argument('-zones',
+                       metavar='seq',
+                       nargs='+',
+                       default=[],
+                       help='Zones across which created instances are spread.')
+
+        o.add_argument('-region',
+                       metavar='name',
+                       type=str,
+                       help='Spread created instances across all zones of a region.')
+
+        o.add_argument('-group',
+                       metavar='name',
+                       type=str,
+                       help='Create, resize or terminate a managed instance group of this name.')
+
+        o.add_argument('-pool',
+                       metavar='name',
+                       type=str,
+                       default='laniakea',
+                       help='Value of the "laniakea-pool" label which identifies instances of a pool.')
+
+        o.add_argument('-interval',
+                       metavar='#',
+                       type=int,
+                       default=60,
+                       help='Seconds between two reconciliations of a pool.')
+
         o.add_argument('-size',
                        metavar='name',
                        type=str,
@@ -130,6 +164,24 @@ class GceCommandLine:
                        default=[],
                        help='Names used for filtering.')
 
+        o.add_argument('-max-workers',
+                       metavar='#',
+                       type=int,
+                       default=32,
+                       help='Maximum amount of concurrent node operations.')
+
+        o.add_argument('-operation-rate',
+                       metavar='#',
+                       type=float,
+                       default=10,
+                       help='Maximum amount of node operations started per second.')
+
+        o.add_argument('-timeout',
+                       metavar='#',
+                       type=int,
+                       default=600,
+                       help='Seconds to wait for node creation and termination to complete.')
+
         o.add_argument('-version',
                        action='version',
                        version='%(prog)s {}'.format(cls.VERSION),
@@ -155,7 +207,8 @@ class GceCommandLine:
 
         # Compute Engine Manager
         try:
-            cluster = ComputeEngineManager(key['client_email'], args.conf.name, key['project_id'])
+            cluster = ComputeEngineManager(key['client_email'], args.conf.name, key['project_id'],
+                                           args.max_workers, args.operation_rate)
             cluster.connect()
             # Remove read |key| from memory which contains the private key.
             del key
@@ -164,7 +217,7 @@ class GceCommandLine:
             return 1
 
         # Create one or many compute VMs.
-        if args.create:
+        if args.create or args.reconcile:
             if args.tags:
                 logger.info('Assigning the following tags to the instance: %r', args.tags)
 
@@ -180,15 +233,54 @@ class GceCommandLine:
                 return 1
 
             logging.debug('VM Configuration: %r', conf)
+            zones = args.zones or (cluster.zones_of_region(args.region) if args.region else [args.zone])
+
+            if args.reconcile:
+                try:
+                    reconciler = PoolReconciler(cluster, args.size, args.count, conf, {'laniakea-pool': args.pool},
+                                                zones, image=args.image, interval=args.interval)
+                except ComputeEngineManagerException as msg:
+                    logging.error(msg)
+                    return 1
+                logging.info('Holding pool %s at %d VM%s in %s ...',
+                             args.pool, args.count, Common.pluralize(args.count), ', '.join(zones))
+                try:
+                    reconciler.run()
+                except KeyboardInterrupt:
+                    logging.info('Stopped reconciling pool %s.', args.pool)
+                return 0
+
+            if args.group:
+                try:
+                    logging.info('Scaling managed instance group %s to %d VM%s of type "%s" ...',
+                                 args.group, args.count, Common.pluralize(args.count), args.size)
+                    cluster.create_group(args.group, args.size, args.count, conf)
+                except (ComputeEngineManagerException, GoogleBaseError) as msg:
+                    logging.error(msg)
+                    return 1
+                return 0
+
             try:
-                logging.info('Creating %d VM%s of type "%s" ...',
-                             args.count, Common.pluralize(args.count), args.size)
-                nodes = cluster.create(args.size, args.count, conf, image=args.image)
-                for node in nodes:
-                    logging.info('Node %s created and %s.', node.name, node.state)
+                logging.info('Creating %d VM%s of type "%s" in %s ...',
+                             args.count, Common.pluralize(args.count), args.size, ', '.join(zones))
+                report = cluster.create_spread(args.size, args.count, conf, zones, image=args.image,
+                                               timeout=args.timeout)
             except ComputeEngineManagerException as msg:
                 logging.error(msg)
                 return 1
+            for operation in report.succeeded:
+                logging.info('Node %s created in %s.', operation.target, operation.zone)
+            if not report or report.skipped:
+                logging.error('We tried but %d nodes failed to create.', len(report.failed) + len(report.skipped))
+
+        if args.terminate and args.group:
+            try:
+                logger.info("Deleting managed instance group %s ...", args.group)
+                cluster.delete_group(args.group, args.zone)
+            except (ComputeEngineManagerException, GoogleBaseError) as msg:
+                logger.error(msg)
+                return 1
+            return 0
 
         # Run filters before dealing with any state routine.
         nodes = []
@@ -196,37 +288,30 @@ class GceCommandLine:
             nodes = cls.list(cls, cluster, args.zone, args.states, args.names, args.tags)
 
         # Routines for other VM states.
-        if args.start:
+        for operation, verb in [('start', 'Starting'), ('stop', 'Stopping'), ('reboot', 'Rebooting')]:
+            if not getattr(args, operation):
+                continue
             try:
-                logger.info("Starting %d node%s ...", len(nodes), Common.pluralize(nodes))
-                cluster.start(nodes)
+                logger.info("%s %d node%s ...", verb, len(nodes), Common.pluralize(nodes))
+                report = cluster.lifecycle(operation, nodes)
             except ComputeEngineManagerException as msg:
                 logger.error(msg)
                 return 1
-
-        if args.stop:
-            try:
-                logger.info("Stopping %d node%s ...", len(nodes), Common.pluralize(nodes))
-                cluster.stop(nodes)
-            except ComputeEngineManagerException as msg:
-                logger.error(msg)
-                return 1
-
-        if args.reboot:
-            try:
-                logger.info("Rebooting %d node%s ...", len(nodes), Common.pluralize(nodes))
-                cluster.reboot(nodes)
-            except ComputeEngineManagerException as msg:
-                logger.error(msg)
+            if report is None or report.failed:
                 return 1
 
-        if args.terminate:
+        if args.terminate and nodes:
             try:
                 logger.info("Terminating %d node%s ...", len(nodes), Common.pluralize(nodes))
-                cluster.terminate_ex(nodes, True)
+                report = cluster.destroy(nodes, timeout=args.timeout)
             except ComputeEngineManagerException as msg:
                 logger.error(msg)
                 return 1
+            if report is None:
+                return 1
+            logger.info('Destroyed %d node%s.', len(report.succeeded), Common.pluralize(report.succeeded))
+            if not report or report.skipped:
+                return 1
 
         if args.list:
             try:
@@ -0,0 +1,294 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Filtering of Google Compute Engine nodes"""
+import re
+
+
+class NodeQuery:
+    """Lazy listing of nodes narrowed by Compute Engine API filter expressions.
+    """
+    # Node states of libcloud and the Compute Engine statuses they are mapped from.
+    STATUSES = {
+        'pending': ['PROVISIONING', 'STAGING', 'STOPPING'],
+        'running': ['RUNNING'],
+        'stopped': ['TERMINATED'],
+        'unknown': ['UNKNOWN'],
+    }
+    # Longer expressions are evaluated client-side to keep request URLs reasonably short.
+    MAX_EXPRESSION_LENGTH = 2000
+
+    def __init__(self, manager, zone='all'):
+        self.manager = manager
+        self.zone = zone
+        self.expressions = []
+
+    def add(self, field, values):
+        """Narrow the query to nodes of which a field matches any of the given values.
+
+        :param  field: Field of the instance resource, i.e. ``status`` or ``labels.owner``.
+        :type   field: ``str``
+
+        :param  values: Accepted values.
+        :type   values: ``list``
+
+        :return: Whether the API is able to evaluate the expression.
+        :rtype:  ``bool``
+        """
+        pattern = '|'.join(re.escape(str(value)) for value in values)
+        expression = '({} eq "{}")'.format(field, pattern)
+        if '"' in pattern or len(expression) > self.MAX_EXPRESSION_LENGTH:
+            return False
+        self.expressions.append(expression)
+        return True
+
+    def fetch(self):
+        """Request the nodes matching all expressions.
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        return self.manager.list_nodes(self.zone, ' '.join(self.expressions) or None)
+
+
+class NodeIndex:
+    """Inventory of nodes with hash indexes on their attributes.
+
+    Nodes are referred to by their position in the inventory. Indexes are built on first use of a field and
+    map each value of that field to the set of positions of the nodes carrying it.
+    """
+    FIELDS = {
+        'name': lambda node: [node.name],
+        'state': lambda node: [str(node.state).lower()],
+        'zone': lambda node: [Kurz.zone(node)],
+        'tag': lambda node: node.extra.get('tags') or [],
+        'label': lambda node: (node.extra.get('labels') or {}).items(),
+        'label_key': lambda node: node.extra.get('labels') or {},
+        'preemptible': lambda node: [bool(Kurz.is_preemtible(node))],
+    }
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self.indexes = {}
+
+    def all(self):
+        """Positions of all nodes.
+
+        :return: Node positions.
+        :rtype:  ``set``
+        """
+        return set(range(len(self.nodes)))
+
+    def lookup(self, field, values):
+        """Positions of the nodes of which a field matches any of the given values.
+
+        :param  field: One of the indexed fields.
+        :type   field: ``str``
+
+        :param  values: Accepted values.
+        :type   values: ``list``
+
+        :return: Node positions.
+        :rtype:  ``set``
+        """
+        index = self.indexes.get(field)
+        if index is None:
+            index = self.indexes[field] = {}
+            keys = self.FIELDS[field]
+            for position, node in enumerate(self.nodes):
+                for key in keys(node):
+                    index.setdefault(key, set()).add(position)
+        result = set()
+        for value in values:
+            result.update(index.get(value, ()))
+        return result
+
+
+class Filter:
+    """Chainable filter class for Node objects.
+
+    Created from a :class:`NodeQuery`, the nodes are only requested once they are accessed and filters which
+    the Compute Engine API can evaluate are sent along with the request. Remaining filters are evaluated as
+    set intersections on a :class:`NodeIndex` of the returned nodes, custom expressions are evaluated last and
+    only for nodes which passed all other filters.
+    """
+
+    def __init__(self, nodes=None, query=None):
+        self.index = NodeIndex(nodes) if nodes is not None else None
+        self.selected = None
+        self.query = query
+        self.selectors = []
+        self.predicates = []
+
+    @property
+    def nodes(self):
+        """The nodes matching all filters.
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        if self.index is None:
+            self.index = NodeIndex(self.query.fetch() if self.query is not None else [])
+            self.query = None
+        for selector in self.selectors:
+            self._intersect(selector(self.index))
+        self.selectors = []
+        if self.selected is None:
+            self.selected = self.index.all()
+        if self.predicates:
+            predicates = self.predicates
+            self.selected = {position for position in self.selected
+                             if all(predicate(self.index.nodes[position]) for predicate in predicates)}
+            self.predicates = []
+        return [self.index.nodes[position] for position in sorted(self.selected)]
+
+    @nodes.setter
+    def nodes(self, nodes):
+        self.index = NodeIndex(nodes)
+        self.selected = None
+        self.query = None
+        self.selectors = []
+        self.predicates = []
+
+    def _intersect(self, positions):
+        self.selected = positions if self.selected is None else self.selected & positions
+
+    def _select(self, field, values):
+        def selector(index):
+            return index.lookup(field, values)
+        if self.index is None:
+            self.selectors.append(selector)
+        else:
+            self._intersect(selector(self.index))
+        return self
+
+    def _lazy(self):
+        return self.index is None and self.query is not None
+
+    def labels(self, labels=None):
+        """Filter by value of labels.
+
+        :param  labels: Labels to filter.
+        :type   labels: ``dict``
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        if not labels:
+            return self
+        if len(labels) == 1 and self._lazy():
+            label, value = next(iter(labels.items()))
+            if self.query.add('labels.' + label, [value]):
+                return self
+        return self._select('label', list(labels.items()))
+
+    def has_labels(self, labels=None):
+        """Filter by presence of labels.
+
+        :param  labels: Labels to filter.
+        :type   labels: ``list``
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        if not labels:
+            return self
+        return self._select('label_key', labels)
+
+    def tags(self, tags=None):
+        """Filter by tags.
+
+        :param  tags: Tags to filter.
+        :type   tags: ``list``
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        if tags is None or not tags:
+            return self
+        return self._select('tag', tags)
+
+    def state(self, states=None):
+        """Filter by state.
+
+        :param  tags: States to filter.
+        :type   tags: ``list``
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        if states is None or not states:
+            return self
+        states = [state.lower() for state in states]
+        if self._lazy() and all(state in NodeQuery.STATUSES for state in states):
+            if self.query.add('status', [status for state in states for status in NodeQuery.STATUSES[state]]):
+                return self
+        return self._select('state', states)
+
+    def name(self, names=None):
+        """Filter by node name.
+
+        :param  names: Node names to filter.
+        :type   names: ``list``
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        if names is None or not names:
+            return self
+        if self._lazy() and self.query.add('name', names):
+            return self
+        return self._select('name', names)
+
+    def zone(self, zones=None):
+        """Filter by zone name.
+
+        :param  zones: Zone names to filter.
+        :type   zones: ``list``
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        if zones is None or not zones:
+            return self
+        return self._select('zone', zones)
+
+    def is_preemptible(self):
+        """Filter by preemptible scheduling.
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        return self._select('preemptible', [True])
+
+    def expr(self, callback):
+        """Filter by custom expression.
+
+        :param  callback: Callback for custom expression.
+        :type   name: ``function``
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        self.predicates.append(callback)
+        return self
+
+
+class Kurz:
+    @staticmethod
+    def is_preemtible(node):
+        return node.extra['scheduling']['preemptible']
+
+    @staticmethod
+    def ips(node):
+        if node.public_ips == [None]:
+            return "N/A"
+        return ','.join(node.public_ips)
+
+    @staticmethod
+    def zone(node):
+        zone = node.extra.get('zone')
+        if not zone:
+            return "N/A"
+        return zone.name
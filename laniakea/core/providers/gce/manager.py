@@ -4,10 +4,18 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """Google Compute Engine API"""
 import sys
+import json
+import time
+import hashlib
+import socket
 import logging
-import threading
+import collections
 
 from laniakea.core.common import Common
+from laniakea.core.executor import BoundedExecutor, OperationReport
+from laniakea.core.retry import ErrorClass, RetryPolicy, TokenBucket
+from .filters import Filter, NodeQuery
+from .operations import Operation, OperationTracker
 
 logger = logging.getLogger('laniakea')
 
@@ -15,167 +23,61 @@ try:
     from libcloud.compute.types import Provider
     from libcloud.compute.providers import get_driver
     from libcloud.compute.drivers.gce import GCEFailedNode
-    from libcloud.common.google import InvalidRequestError
+    from libcloud.common.google import GoogleBaseError, ResourceNotFoundError
 except ImportError as msg:
     logger.error(msg)
     sys.exit(-1)
 
 
-class Filter:
-    """Chainable filter class for Node objects.
-    """
-
-    def __init__(self, nodes=None):
-        self.nodes = nodes
-
-    def labels(self, labels=None):
-        """Filter by value of labels.
-
-        :param  labels: Labels to filter.
-        :type   labels: ``dict``
-
-        :return: A list of Node objects.
-        :rtype:  ``list`` of :class:`Node`
-        """
-        if not labels:
-            return self
-        nodes = []
-        for node in self.nodes:
-            if any((label in node.extra['labels'] and node.extra['labels'][label] == value)
-                   for label, value in labels.items()):
-                nodes.append(node)
-        self.nodes = nodes
-        return self
-
-    def has_labels(self, labels=None):
-        """Filter by presence of labels.
-
-        :param  labels: Labels to filter.
-        :type   labels: ``list``
-
-        :return: A list of Node objects.
-        :rtype:  ``list`` of :class:`Node`
-        """
-        if not labels:
-            return self
-        nodes = []
-        for node in self.nodes:
-            if set(labels) & set(node.extra['labels'] or []):
-                nodes.append(node)
-        self.nodes = nodes
-        return self
-
-    def tags(self, tags=None):
-        """Filter by tags.
-
-        :param  tags: Tags to filter.
-        :type   tags: ``list``
-
-        :return: A list of Node objects.
-        :rtype:  ``list`` of :class:`Node`
-        """
-        if tags is None or not tags:
-            return self
-        nodes = []
-        for node in self.nodes:
-            if any(tag in node.extra['tags'] for tag in tags):
-                nodes.append(node)
-        self.nodes = nodes
-        return self
-
-    def state(self, states=None):
-        """Filter by state.
-
-        :param  tags: States to filter.
-        :type   tags: ``list``
-
-        :return: A list of Node objects.
-        :rtype:  ``list`` of :class:`Node`
-        """
-        if states is None or not states:
-            return self
-        nodes = []
-        for node in self.nodes:
-            if any(state.lower() == node.state.lower() for state in states):
-                nodes.append(node)
-        self.nodes = nodes
-        return self
-
-    def name(self, names=None):
-        """Filter by node name.
-
-        :param  names: Node names to filter.
-        :type   names: ``list``
+GCE_THROTTLING_ERRORS = frozenset(['rateLimitExceeded', 'userRateLimitExceeded', 'RATE_LIMIT_EXCEEDED'])
+GCE_API_BUCKET = TokenBucket(rate=20, capacity=50)
+# Error codes of failed instance insertions which are specific to a zone and may succeed in another zone.
+GCE_CAPACITY_ERRORS = frozenset(['ZONE_RESOURCE_POOL_EXHAUSTED', 'ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS'])
 
-        :return: A list of Node objects.
-        :rtype:  ``list`` of :class:`Node`
-        """
-        if names is None or not names:
-            return self
-        nodes = []
-        for node in self.nodes:
-            if any(name == node.name for name in names):
-                nodes.append(node)
-        self.nodes = nodes
-        return self
-
-    def is_preemptible(self):
-        """Filter by preemptible scheduling.
-
-        :return: A list of Node objects.
-        :rtype:  ``list`` of :class:`Node`
-        """
-        nodes = []
-        for node in self.nodes:
-            if Kurz.is_preemtible(node):
-                nodes.append(node)
-        return self
 
-    def expr(self, callback):
-        """Filter by custom expression.
+def classify_gce_error(error):
+    """Classify errors raised by libcloud for the retry policy of ComputeEngineManager.
 
-        :param  callback: Callback for custom expression.
-        :type   name: ``function``
+    :param  error: The raised exception.
+    :type   error: ``Exception``
 
-        :return: A list of Node objects.
-        :rtype:  ``list`` of :class:`Node`
-        """
-        nodes = []
-        for node in self.nodes:
-            if callback(node):
-                nodes.append(node)
-        self.nodes = nodes
-        return self
+    :return: An ErrorClass value.
+    :rtype:  ``str``
+    """
+    if isinstance(error, socket.error):
+        return ErrorClass.TRANSIENT
+    if isinstance(error, GoogleBaseError):
+        if error.code in GCE_THROTTLING_ERRORS:
+            return ErrorClass.THROTTLED
+        if (error.http_code or 0) >= 500:
+            return ErrorClass.TRANSIENT
+    return ErrorClass.FATAL
 
 
-class Kurz:
-    @staticmethod
-    def is_preemtible(node):
-        return node.extra['scheduling']['preemptible']
+def classify_gce_create_error(error):
+    """Classify errors raised while creating resources, only throttled requests are safe to repeat.
 
-    @staticmethod
-    def ips(node):
-        if node.public_ips == [None]:
-            return "N/A"
-        return ','.join(node.public_ips)
+    :param  error: The raised exception.
+    :type   error: ``Exception``
 
-    @staticmethod
-    def zone(node):
-        zone = node.extra.get('zone')
-        if not zone:
-            return "N/A"
-        return zone.name
+    :return: An ErrorClass value.
+    :rtype:  ``str``
+    """
+    error_class = classify_gce_error(error)
+    return error_class if error_class == ErrorClass.THROTTLED else ErrorClass.FATAL
 
 
 class ComputeEngineManagerException(Exception):
     """Exception class for Google Compute Engine Manager."""
 
 
-class ComputeEngineManager:
+# The retry policies of API requests and the executor of node operations are shared by all requests.
+class ComputeEngineManager:  # pylint: disable=too-many-instance-attributes
     """Google Compute Engine Manager base class.
     """
+    PAGE_SIZE = 500
 
-    def __init__(self, user_id, key, project):
+    def __init__(self, user_id, key, project, max_workers=32, operation_rate=10):
         """Initialize Compute Engine Manager
 
         :param   user_id: Email address (Service Accounts) or Client ID
@@ -186,6 +88,12 @@ class ComputeEngineManager:
 
         :param   project: GCE project name
         :type    project: ``str``
+
+        :param   max_workers: Maximum amount of concurrent node operations.
+        :type    max_workers: ``int``
+
+        :param   operation_rate: Maximum amount of node operations started per second.
+        :type    operation_rate: ``float``
         """
         self.logger = logging.getLogger(self.__class__.__name__)
         self.user_id = user_id
@@ -193,6 +101,9 @@ class ComputeEngineManager:
         self.project = project
         self.gce = None
         self.nodes = []
+        self.retry = RetryPolicy(classify_gce_error, bucket=GCE_API_BUCKET)
+        self.create_retry = RetryPolicy(classify_gce_create_error, bucket=GCE_API_BUCKET)
+        self.executor = BoundedExecutor(max_workers, operation_rate, self.retry)
 
     def connect(self, **kwargs):
         """Connect to Google Compute Engine.
@@ -283,102 +194,358 @@ class ComputeEngineManager:
 
         return nodes
 
-    def stop(self, nodes=None):
-        """Stop one or many nodes.
+    def submit_create(self, size, number, meta, name=None, image=None):
+        """Request the creation of nodes without waiting for them to be created.
 
-        :param   nodes: Nodes to be stopped.
-        :type    nodes: ``list``
+        :param   size: The machine type to use.
+        :type    size: ``str`` or :class:`GCENodeSize`
+
+        :param   number: Amount of nodes to be spawned.
+        :type    number: ``int``
+
+        :param   meta: Keyword arguments of create_node(), i.e. as returned by build_container_vm().
+        :type    meta: ``dict``
+
+        :param   name: Name of a single node or base name of multiple nodes.
+        :type    name: ``str``
+
+        :param   image: The image used to create the disk - optional if the disks are part of `meta`.
+        :type    image: ``str`` or :class:`GCENodeImage` or ``None``
+
+        :return: Operation handles, one for each node.
+        :rtype:  ``list`` of :class:`Operation`
         """
         if not self.is_connected():
             return None
 
-        nodes = nodes or self.nodes
-        result = []
+        if name is None:
+            name = Common.get_random_hostname()
 
-        for node in nodes:
-            if node.state == 'stopped':
-                logging.warning('Node %s is already "stopped".', node.name)
-                continue
+        kwargs = dict(meta)
+        location = kwargs.pop('location', None) or self.gce.zone
+        if not hasattr(location, 'name'):
+            location = self.gce.ex_get_zone(location)
+        if not hasattr(size, 'name'):
+            size = self.gce.ex_get_size(size, location)
+        network = kwargs.pop('ex_network', 'default')
+        if not hasattr(network, 'name'):
+            network = self.gce.ex_get_network(network)
+        if kwargs.get('ex_disks_gce_struct'):
+            image = None
+        elif image is None:
+            raise ComputeEngineManagerException("Base image not provided.")
+        elif not hasattr(image, 'name'):
+            image = self.gce.ex_get_image(image)
+        metadata = kwargs.pop('ex_metadata', None)
+        tags = kwargs.pop('ex_tags', None)
+
+        names = [name] if number == 1 else ['%s-%03d' % (name, i) for i in range(number)]
+
+        def submit(node_name):
+            request, data = self.gce._create_node_req(  # pylint: disable=protected-access
+                node_name, size, image, location, network, tags, metadata, **kwargs)
             try:
-                status = self.gce.ex_stop_node(node)
-                if status:
-                    result.append(node)
-            except InvalidRequestError as err:
-                raise ComputeEngineManagerException(err)
+                response = self.create_retry(self.gce.connection.request, request, method='POST', data=data).object
+            except GoogleBaseError as error:
+                return Operation('insert', node_name, location.name, error=error.value, code=error.code)
+            return Operation('insert', node_name, location.name, response)
 
-        return result
+        report = self._submitter().run(submit, names, operation='insert')
+        return report.results + [Operation('insert', node_name, location.name, error=str(error) or repr(error))
+                                 for node_name, error in report.failed]
 
-    def start(self, nodes=None):
-        """Start one or many nodes.
+    def create_spread(self, size, number, meta, zones, name=None, image=None, attempts=3, timeout=None):
+        """Create nodes spread across many zones and move nodes of exhausted zones to the remaining zones.
 
-        :param   nodes: Nodes to be started.
-        :type    nodes: ``list``
+        :param   size: The machine type to use.
+        :type    size: ``str`` or :class:`GCENodeSize`
+
+        :param   number: Amount of nodes to be spawned.
+        :type    number: ``int``
+
+        :param   meta: Keyword arguments of create_node(), i.e. as returned by build_container_vm().
+        :type    meta: ``dict``
+
+        :param   zones: Names of the zones to spread the nodes across.
+        :type    zones: ``list``
+
+        :param   name: Base name of the nodes, random if None.
+        :type    name: ``str``
+
+        :param   image: The image used to create the disk - optional if the disks are part of `meta`.
+        :type    image: ``str`` or :class:`GCENodeImage` or ``None``
+
+        :param   attempts: The amount of rounds in which nodes of exhausted zones are redistributed.
+        :type    attempts: ``int``
+
+        :param   timeout: Maximum seconds to wait for all rounds, forever if None.
+        :type    timeout: ``float``
+
+        :return: Outcome of the insert operations.
+        :rtype:  :class:`OperationReport`
+        """
+        if not zones:
+            raise ComputeEngineManagerException("No zones provided.")
+
+        report = OperationReport('insert')
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        exhausted = set()
+        unplaced = []
+        remaining = number
+
+        for attempt in range(attempts):
+            available = [zone for zone in zones if zone not in exhausted]
+            if not remaining or not available:
+                break
+            plan = self.spread(remaining, available)
+            self.logger.info("Requesting %s", ', '.join('%d in %s' % (count, zone) for zone, count in plan.items()))
+
+            def submit(item, attempt=attempt):
+                zone, count = item
+                base_name = '%s-%s-%d' % (name, zone, attempt) if name else None
+                return self.submit_create(size, count, dict(meta, location=zone), name=base_name, image=image)
+
+            submitted = BoundedExecutor(len(plan)).run(submit, list(plan.items()), operation='insert')
+            remaining = 0
+            for (zone, count), _ in submitted.failed:
+                exhausted.add(zone)
+                remaining += count
+
+            unplaced = []
+            tracker = self.track([operation for operations in submitted.results for operation in operations])
+            wait = max(0, deadline - time.monotonic()) if deadline is not None else None
+            for operation in tracker.iter_completed(wait):
+                if operation.succeeded:
+                    report.success(operation)
+                elif operation.code in GCE_CAPACITY_ERRORS:
+                    self.logger.warning("Zone %s is out of capacity.", operation.zone)
+                    exhausted.add(operation.zone)
+                    unplaced.append(operation)
+                    remaining += 1
+                else:
+                    self.logger.error("Node %s failed to create, code %s error: %s",
+                                      operation.target, operation.code, operation.error)
+                    report.failure(operation, operation.error)
+            for operation in tracker.pending.values():
+                report.skip(operation, 'Timed out')
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+        for operation in unplaced:
+            report.failure(operation, operation.error)
+        if remaining:
+            self.logger.error("We tried but %d nodes could not be placed in any zone.", remaining)
+        return report
+
+    @staticmethod
+    def spread(number, zones):
+        """Divide an amount of nodes evenly across zones.
+
+        :param   number: Amount of nodes.
+        :type    number: ``int``
+
+        :param   zones: Names of the zones.
+        :type    zones: ``list``
+
+        :return: Amount of nodes by zone, zones without nodes are omitted.
+        :rtype:  ``OrderedDict``
+        """
+        base, extra = divmod(number, len(zones))
+        plan = collections.OrderedDict()
+        for i, zone in enumerate(zones):
+            count = base + (1 if i < extra else 0)
+            if count:
+                plan[zone] = count
+        return plan
+
+    def zones_of_region(self, region):
+        """Names of the available zones of a region.
+
+        :param   region: Name of the region, i.e. 'us-east1'.
+        :type    region: ``str``
+
+        :return: Zone names.
+        :rtype:  ``list``
         """
         if not self.is_connected():
             return None
+        return sorted(zone.name for zone in self.gce.zone_dict.values()
+                      if zone.name.startswith(region + '-') and zone.status == 'UP')
 
-        nodes = nodes or self.nodes
-        result = []
+    def submit_destroy(self, nodes=None):
+        """Request the destruction of nodes without waiting for them to be destroyed.
 
-        for node in nodes:
-            if node.state == 'running':
-                logging.warning('Node %s is already "running".', node.name)
-                continue
+        :param   nodes: Nodes to be destroyed.
+        :type    nodes: ``list``
+
+        :return: Operation handles, one for each node.
+        :rtype:  ``list`` of :class:`Operation`
+        """
+        if not self.is_connected():
+            return None
+
+        def submit(node):
+            zone = node.extra['zone'].name
+            request = '/zones/%s/instances/%s' % (zone, node.name)
             try:
-                status = self.gce.ex_start_node(node)
-                if status:
-                    result.append(node)
-            except InvalidRequestError as err:
-                raise ComputeEngineManagerException(err)
+                response = self.retry_delete(self.gce.connection.request, request, method='DELETE')
+            except GoogleBaseError as error:
+                return Operation('delete', node.name, zone, error=error.value, code=error.code)
+            # Without a response, an earlier attempt already deleted the node.
+            return Operation('delete', node.name, zone, response.object if response is not None else None)
 
-        return result
+        report = self._submitter().run(submit, nodes or self.nodes, operation='delete')
+        return report.results + [Operation('delete', node.name, node.extra['zone'].name,
+                                           error=str(error) or repr(error))
+                                 for node, error in report.failed]
 
-    def reboot(self, nodes=None):
-        """Reboot one or many nodes.
+    def _submitter(self):
+        # Submissions retry their own requests and turn API errors into failed operation handles.
+        return BoundedExecutor(self.executor.max_workers, self.executor.rate)
 
-        :param   nodes: Nodes to be rebooted.
+    def track(self, operations, poll_interval=2.0):
+        """Create a tracker for asynchronous operations.
+
+        :param   operations: Operations to track.
+        :type    operations: ``list`` of :class:`Operation`
+
+        :param   poll_interval: Seconds between two polls.
+        :type    poll_interval: ``float``
+
+        :return: A tracker of the operations.
+        :rtype:  :class:`OperationTracker`
+        """
+        return OperationTracker(self, operations, poll_interval)
+
+    def lifecycle(self, operation, nodes=None):
+        """Start, stop or reboot nodes concurrently.
+
+        :param   operation: One of 'start', 'stop' or 'reboot'.
+        :type    operation: ``str``
+
+        :param   nodes: Nodes to operate on.
         :type    nodes: ``list``
+
+        :return: Outcome of the operation for each node.
+        :rtype:  :class:`OperationReport`
         """
         if not self.is_connected():
             return None
 
-        nodes = nodes or self.nodes
-        result = []
+        if operation == 'start':
+            func, skipped_state = self.gce.ex_start_node, 'running'
+        elif operation == 'stop':
+            func, skipped_state = self.gce.ex_stop_node, 'stopped'
+        elif operation == 'reboot':
+            func, skipped_state = self.gce.reboot_node, 'stopped'
+        else:
+            raise ComputeEngineManagerException("Unknown operation: %s" % operation)
+
+        def skip(node):
+            if node.state == skipped_state:
+                return 'Node %s is "%s".' % (node.name, skipped_state)
+            return None
 
-        for node in nodes:
-            if node.state == 'stopped':
-                logging.warning('Node %s is "stopped" and can not be rebooted.', node.name)
-                continue
-            try:
-                status = self.gce.reboot_node(node)
-                if status:
-                    result.append(node)
-            except InvalidRequestError as err:
-                raise ComputeEngineManagerException(err)
+        report = self.executor.run(func, nodes or self.nodes, skip=skip, operation=operation)
+        for _, reason in report.skipped:
+            self.logger.warning(reason)
+        self.logger.info(report.summary())
+        return report
+
+    def stop(self, nodes=None):
+        """Stop one or many nodes.
+
+        :param   nodes: Nodes to be stopped.
+        :type    nodes: ``list``
+
+        :return: List of nodes which were stopped.
+        :rtype:  ``list``
+        """
+        report = self.lifecycle('stop', nodes)
+        return report.succeeded if report is not None else None
+
+    def start(self, nodes=None):
+        """Start one or many nodes.
+
+        :param   nodes: Nodes to be started.
+        :type    nodes: ``list``
+
+        :return: List of nodes which were started.
+        :rtype:  ``list``
+        """
+        report = self.lifecycle('start', nodes)
+        return report.succeeded if report is not None else None
+
+    def reboot(self, nodes=None):
+        """Reboot one or many nodes.
+
+        :param   nodes: Nodes to be rebooted.
+        :type    nodes: ``list``
 
-        return result
+        :return: List of nodes which were rebooted.
+        :rtype:  ``list``
+        """
+        report = self.lifecycle('reboot', nodes)
+        return report.succeeded if report is not None else None
 
     def terminate_nowait(self, nodes=None):
         """Destroy one or many nodes, without waiting to see that the node is destroyed.
 
         :param   nodes: Nodes to be destroyed.
         :type    nodes: ``list``
+
+        :return: Operation handles, one for each node.
+        :rtype:  ``list`` of :class:`Operation`
         """
-        if not self.is_connected():
-            return
+        operations = self.submit_destroy(nodes)
+        if operations is None:
+            return None
+        failed = [operation for operation in operations if operation.error is not None]
+        if failed:
+            raise ComputeEngineManagerException("Failed to request destruction of %d nodes: %s" %
+                                                (len(failed), failed[0].error))
+        logging.info('Requested destruction of %d nodes', len(operations))
+        return operations
 
-        nodes = nodes or self.nodes
+    def destroy(self, nodes=None, attempts=3, timeout=None):
+        """Destroy one or many nodes asynchronously and request the destruction of failed nodes again.
 
-        try:
-            self.gce.ex_destroy_multiple_nodes(nodes, timeout=0, ignore_errors=False)
-        except Exception as error:  # pylint: disable=broad-except
-            # directly check type since the exception should be exactly `Exception` and not a subclass
-            if type(error) is Exception and "timeout" in str(error).lower():  # pylint: disable=unidiomatic-typecheck
-                # success
-                logging.info('Requested destruction of %d nodes', len(nodes))
-                return
-            raise
-        raise Exception("Call to ex_destroy_multiple_nodes() returned unexpectedly.")
+        :param   nodes: Nodes to be destroyed.
+        :type    nodes: ``list``
+
+        :param   attempts: The amount of attempts for destroying each node.
+        :type    attempts: ``int``
+
+        :param   timeout: Maximum seconds to wait for all attempts, forever if None.
+        :type    timeout: ``float``
+
+        :return: Outcome of the last delete operation of each node.
+        :rtype:  :class:`OperationReport`
+        """
+        report = OperationReport('delete')
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        nodes = nodes or self.nodes
+        while nodes:
+            attempts -= 1
+            operations = self.submit_destroy(nodes)
+            if operations is None:
+                return None
+            wait = max(0, deadline - time.monotonic()) if deadline is not None else None
+            result = self.track(operations).wait(wait)
+            for operation in result.succeeded:
+                report.success(operation)
+            for operation, reason in result.skipped:
+                report.skip(operation, reason)
+            if not result.failed:
+                break
+            if attempts <= 0 or (deadline is not None and time.monotonic() >= deadline):
+                for operation, error in result.failed:
+                    report.failure(operation, error)
+                break
+            by_name = {node.name: node for node in nodes}
+            nodes = [by_name[operation.target] for operation in result.failed_items]
+            self.logger.info("Attempt to terminate the remaining %d nodes once more.", len(nodes))
+        return report
 
     def terminate(self, nodes=None):
         """Destroy one or many nodes.
@@ -408,7 +575,7 @@ class ComputeEngineManager:
         return failed_kill
 
     def terminate_with_threads(self, nodes=None):
-        """Destroy one or many nodes threaded.
+        """Destroy one or many nodes with a bounded pool of workers.
 
         :param   nodes: Nodes to be destroyed.
         :type    nodes: ``list``
@@ -420,25 +587,41 @@ class ComputeEngineManager:
             return None
 
         nodes = nodes or self.nodes
-        failed_kill = []
-
-        def worker(gce, node):
-            self.logger.info("Terminating node: %s", node.name)
-            terminated = gce.destroy_node(node)
-            if not terminated:
-                failed_kill.append(node)
 
-        threads = []
-        for node in nodes:
-            thread = threading.Thread(target=worker, args=(self.gce, node))
-            threads.append(thread)
-            thread.start()
+        def destroy(node):
+            return self.retry_delete(self.gce.destroy_node, node)
 
         self.logger.info("Waiting for nodes to shut down ...")
-        for thread in threads:
-            thread.join()
+        executor = BoundedExecutor(self.executor.max_workers, self.executor.rate)
+        report = executor.run(destroy, nodes, operation='terminate')
+        self.logger.info(report.summary())
 
-        return failed_kill
+        return report.failed_items
+
+    def retry_delete(self, func, *args, **kwargs):
+        """Call a delete request under the retry policy.
+
+        Deletes are not idempotent: if an attempt timed out although the resource was deleted, the next
+        attempt fails with a 404 which is treated as success.
+
+        :param   func: Function issuing the delete request.
+        :type    func: ``function``
+
+        :return: The result of the request or None if an earlier attempt deleted the resource.
+        """
+        attempts = []
+
+        def delete():
+            attempts.append(None)
+            try:
+                return func(*args, **kwargs)
+            except ResourceNotFoundError:
+                if len(attempts) == 1:
+                    raise
+                self.logger.info("Resource was already deleted by an earlier attempt.")
+                return None
+
+        return self.retry(delete)
 
     def terminate_ex(self, nodes, threads=False, attempts=3):
         """Wrapper method for terminate.
@@ -486,7 +669,7 @@ class ComputeEngineManager:
             }
         }
 
-    def build_container_vm(self, container, disk, zone="us-east1-b", tags=None, preemptible=True):
+    def build_container_vm(self, container, disk, zone="us-east1-b", tags=None, preemptible=True, labels=None):
         """Build kwargs for a container VM.
 
         :param   container: Container declaration.
@@ -503,6 +686,9 @@ class ComputeEngineManager:
 
         :param   preemptible: Wether the instance is a preemtible or not.
         :type    preemptible: ``bool``
+
+        :param   labels: Labels associated with the instance.
+        :type    labels: ``dict``
         """
         if tags is None:
             tags = []
@@ -510,7 +696,7 @@ class ComputeEngineManager:
             raise ComputeEngineManagerException("Container declaration must not be None.")
         if disk is None:
             raise ComputeEngineManagerException("Disk structure must not be None.")
-        return {
+        conf = {
             'ex_metadata': {
                 "gce-container-declaration": container,
                 "google-logging-enabled": "true"
@@ -526,6 +712,126 @@ class ComputeEngineManager:
             'ex_disks_gce_struct': [disk],
             'ex_preemptible': preemptible
         }
+        if labels:
+            conf['ex_labels'] = labels
+        return conf
+
+    def create_template(self, name, size, meta):
+        """Get or create an instance template from container VM kwargs.
+
+        Templates are immutable, hence the name of the template is suffixed with a digest of its
+        configuration and a changed configuration results in a new template.
+
+        :param   name: Base name of the template.
+        :type    name: ``str``
+
+        :param   size: The machine type to use.
+        :type    size: ``str``
+
+        :param   meta: Container VM kwargs as returned by build_container_vm().
+        :type    meta: ``dict``
+
+        :return: The instance template.
+        :rtype:  :class:`GCEInstanceTemplate`
+        """
+        if not self.is_connected():
+            return None
+
+        properties = {
+            'metadata': meta.get('ex_metadata'),
+            'service_accounts': meta.get('ex_service_accounts'),
+            'tags': meta.get('ex_tags'),
+            'disks_gce_struct': meta.get('ex_disks_gce_struct'),
+            'preemptible': meta.get('ex_preemptible'),
+        }
+        size = getattr(size, 'name', size)
+        digest = hashlib.sha1(json.dumps([size, properties], sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        template_name = '%s-%s' % (name, digest)
+        try:
+            return self.retry(self.gce.ex_get_instancetemplate, template_name)
+        except ResourceNotFoundError:
+            pass
+        self.logger.info("Creating instance template %s", template_name)
+        return self.retry(self.gce.ex_create_instancetemplate, template_name, size, **properties)
+
+    def create_group(self, name, size, number, meta):
+        """Create or resize a managed instance group of container VMs.
+
+        The control plane creates and recreates the nodes of the group, a single call suffices to
+        scale the group to any size.
+
+        :param   name: Name of the group, also used as base name of the template and the nodes.
+        :type    name: ``str``
+
+        :param   size: The machine type to use.
+        :type    size: ``str``
+
+        :param   number: Target size of the group.
+        :type    number: ``int``
+
+        :param   meta: Container VM kwargs as returned by build_container_vm().
+        :type    meta: ``dict``
+
+        :return: The instance group manager.
+        :rtype:  :class:`GCEInstanceGroupManager`
+        """
+        if not self.is_connected():
+            return None
+
+        template = self.create_template(name, size, meta)
+        zone = meta.get('location') or self.gce.zone
+        try:
+            group = self.retry(self.gce.ex_get_instancegroupmanager, name, zone)
+        except ResourceNotFoundError:
+            self.logger.info("Creating managed instance group %s of %d nodes", name, number)
+            return self.retry(self.gce.ex_create_instancegroupmanager, name, zone, template, number,
+                              base_instance_name=name)
+
+        if group.template.name != template.name:
+            self.logger.info("Switching managed instance group %s to template %s", name, template.name)
+            self.retry(self.gce.ex_instancegroupmanager_set_instancetemplate, group, template)
+        if group.size != number:
+            self.logger.info("Resizing managed instance group %s from %d to %d nodes", name, group.size, number)
+            self.retry(self.gce.ex_instancegroupmanager_resize, group, number)
+            group.size = number
+        return group
+
+    def resize_group(self, name, number, zone=None):
+        """Resize a managed instance group.
+
+        :param   name: Name of the group.
+        :type    name: ``str``
+
+        :param   number: Target size of the group.
+        :type    number: ``int``
+
+        :param   zone: Zone of the group.
+        :type    zone: ``str``
+
+        :return: True if successful.
+        :rtype:  ``bool``
+        """
+        if not self.is_connected():
+            return None
+        group = self.retry(self.gce.ex_get_instancegroupmanager, name, zone)
+        return self.retry(self.gce.ex_instancegroupmanager_resize, group, number)
+
+    def delete_group(self, name, zone=None):
+        """Delete a managed instance group including all of its nodes.
+
+        :param   name: Name of the group.
+        :type    name: ``str``
+
+        :param   zone: Zone of the group.
+        :type    zone: ``str``
+
+        :return: True if successful.
+        :rtype:  ``bool``
+        """
+        if not self.is_connected():
+            return None
+        group = self.retry(self.gce.ex_get_instancegroupmanager, name, zone)
+        return self.retry(self.gce.ex_destroy_instancegroupmanager, group)
 
     def filter(self, zone='all'):
         """Filter nodes by their attributes.
@@ -539,5 +845,71 @@ class ComputeEngineManager:
         if not self.is_connected():
             return None
 
-        nodes = self.gce.list_nodes(zone)
-        return Filter(nodes)
+        return Filter(query=NodeQuery(self, zone))
+
+    def list_nodes(self, zone='all', expression=None):
+        """List nodes page by page, narrowed down by the API.
+
+        :param  zone: A zone containing nodes or 'all'.
+        :type   zone: ``str``
+
+        :param  expression: Compute Engine filter expression.
+        :type   expression: ``str``
+
+        :return: A list of Node objects.
+        :rtype:  ``list`` of :class:`Node`
+        """
+        if not self.is_connected():
+            return None
+
+        nodes = []
+        for item in self.list_resources('instances', zone, expression):
+            try:
+                nodes.append(self._to_node(item))
+            except ResourceNotFoundError:
+                continue
+        return nodes
+
+    def list_resources(self, kind, zone='all', expression=None):
+        """Iterate page by page over raw resources of a zonal collection.
+
+        :param  kind: Name of the collection, i.e. 'instances' or 'operations'.
+        :type   kind: ``str``
+
+        :param  zone: A zone name or 'all' for the aggregated list.
+        :type   zone: ``str``
+
+        :param  expression: Compute Engine filter expression.
+        :type   expression: ``str``
+
+        :return: Resources as returned by the API.
+        :rtype:  ``generator`` of ``dict``
+        """
+        aggregated = zone in (None, 'all')
+        path = '/aggregated/%s' % kind if aggregated else '/zones/%s/%s' % (zone, kind)
+        params = {'maxResults': self.PAGE_SIZE}
+        if expression:
+            params['filter'] = expression
+
+        while True:
+            response = self.retry(self.gce.connection.request, path, method='GET', params=dict(params)).object
+            if aggregated:
+                for scope in response.get('items', {}).values():
+                    for item in scope.get(kind, []):
+                        yield item
+            else:
+                for item in response.get('items', []):
+                    yield item
+            if not response.get('nextPageToken'):
+                break
+            params['pageToken'] = response['nextPageToken']
+
+    def _to_node(self, item):
+        """Convert an instance resource to a Node object without looking up its boot disk.
+
+        libcloud resolves the boot disk of every node with an additional request, which Laniakea does not use.
+        """
+        disks = item.get('disks', [])
+        node = self.gce._to_node(dict(item, disks=[]))  # pylint: disable=protected-access
+        node.extra['disks'] = disks
+        return node
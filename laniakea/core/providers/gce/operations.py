@@ -0,0 +1,185 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Asynchronous Google Compute Engine operations"""
+import re
+import time
+import logging
+import collections
+
+from laniakea.core.executor import OperationReport
+from .filters import NodeQuery
+
+logger = logging.getLogger('laniakea')
+
+
+class Operation:
+    """Handle of an asynchronous Compute Engine zone operation.
+    """
+
+    def __init__(self, kind, target, zone, response=None, error=None, code=None):
+        """
+        :param  kind: Type of the operation, i.e. 'insert' or 'delete'.
+        :type   kind: ``str``
+
+        :param  target: Name of the node the operation applies to.
+        :type   target: ``str``
+
+        :param  zone: Name of the zone of the node.
+        :type   zone: ``str``
+
+        :param  response: Operation resource returned by the API.
+        :type   response: ``dict``
+
+        :param  error: Error message if the operation could not be submitted.
+        :type   error: ``str``
+
+        :param  code: Error code if the operation could not be submitted.
+        :type   code: ``str``
+        """
+        self.kind = kind
+        self.target = target
+        self.zone = zone
+        self.name = None
+        self.status = 'DONE'
+        self.error = error
+        self.code = code
+        if response is not None:
+            self.update(response)
+
+    def update(self, response):
+        """Update the handle from an operation resource.
+
+        :param  response: Operation resource returned by the API.
+        :type   response: ``dict``
+        """
+        self.name = response.get('name', self.name)
+        self.status = response.get('status', self.status)
+        errors = (response.get('error') or {}).get('errors') or []
+        if errors:
+            self.code = errors[0].get('code')
+            self.error = errors[0].get('message') or self.code
+
+    @property
+    def done(self):
+        return self.status == 'DONE'
+
+    @property
+    def succeeded(self):
+        return self.done and self.error is None
+
+    def __repr__(self):
+        return '<Operation %s %s/%s: %s>' % (self.kind, self.zone, self.target, self.status)
+
+
+class OperationTracker:
+    """Poll many asynchronous operations with one aggregated list request per tick.
+    """
+    PAGE_SIZE = 500
+
+    def __init__(self, manager, operations=None, poll_interval=2.0):
+        """
+        :param  manager: Manager used to issue the requests.
+        :type   manager: :class:`ComputeEngineManager`
+
+        :param  operations: Operations to track.
+        :type   operations: ``list`` of :class:`Operation`
+
+        :param  poll_interval: Seconds between two polls.
+        :type   poll_interval: ``float``
+        """
+        self.manager = manager
+        self.poll_interval = poll_interval
+        self.operations = []
+        self.pending = collections.OrderedDict()
+        self.add(operations or [])
+
+    def add(self, operations):
+        """Track additional operations.
+
+        :param  operations: Operations to track.
+        :type   operations: ``list`` of :class:`Operation`
+        """
+        for operation in operations:
+            self.operations.append(operation)
+            if not operation.done:
+                self.pending[operation.name] = operation
+
+    def poll(self):
+        """Request the state of all pending operations once.
+
+        :return: Operations which completed since the last poll.
+        :rtype:  ``list`` of :class:`Operation`
+        """
+        completed = []
+        chunks = [[]]
+        length = 0
+        for name in self.pending:
+            name = re.escape(name)
+            if chunks[-1] and length + len(name) + 1 > NodeQuery.MAX_EXPRESSION_LENGTH - 20:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(name)
+            length += len(name) + 1
+        for chunk in chunks:
+            if not chunk:
+                continue
+            expression = '(name eq "{}")'.format('|'.join(chunk))
+            for item in self.manager.list_resources('operations', 'all', expression):
+                operation = self.pending.get(item.get('name'))
+                if operation is None:
+                    continue
+                operation.update(item)
+                if operation.done:
+                    completed.append(self.pending.pop(operation.name))
+        return completed
+
+    def discard_completed(self):
+        """Stop remembering operations which already completed.
+        """
+        self.operations = [operation for operation in self.operations if not operation.done]
+
+    def iter_completed(self, timeout=None):
+        """Poll until all operations completed or the deadline passed.
+
+        :param  timeout: Maximum seconds to wait, forever if None.
+        :type   timeout: ``float``
+
+        :return: Operations in the order of completion.
+        :rtype:  ``generator`` of :class:`Operation`
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for operation in self.operations:
+            if operation.done:
+                yield operation
+        while self.pending:
+            for operation in self.poll():
+                yield operation
+            if not self.pending:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.warning('%d operations did not complete in time.', len(self.pending))
+                break
+            time.sleep(self.poll_interval)
+
+    def wait(self, timeout=None):
+        """Wait for all operations and report their outcome.
+
+        :param  timeout: Maximum seconds to wait, forever if None.
+        :type   timeout: ``float``
+
+        :return: Succeeded and failed operations, operations which did not complete are skipped.
+        :rtype:  :class:`OperationReport`
+        """
+        report = OperationReport('operations')
+        for operation in self.iter_completed(timeout):
+            if operation.succeeded:
+                report.success(operation)
+            else:
+                logger.error('Operation %s for %s failed, code %s error: %s',
+                             operation.kind, operation.target, operation.code, operation.error)
+                report.failure(operation, operation.error)
+        for operation in self.pending.values():
+            report.skip(operation, 'Timed out')
+        return report
@@ -0,0 +1,125 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Reconciliation of Google Compute Engine node pools"""
+import time
+import socket
+import collections
+
+from laniakea.core.common import Common
+from .manager import ComputeEngineManagerException, GoogleBaseError
+from .operations import OperationTracker
+
+
+ReconcileStatus = collections.namedtuple('ReconcileStatus', ['alive', 'dead', 'creating', 'deleting', 'created',
+                                                         'deleted'])
+# What the nodes of a pool look like and where they are created.
+PoolSpec = collections.namedtuple('PoolSpec', ['size', 'target', 'meta', 'labels', 'zones', 'image'])
+
+
+class PoolReconciler:
+    """Hold a labeled pool of nodes at a target size.
+
+    Each tick lists the nodes of the pool with a single label-filtered request, destroys nodes which were
+    preempted or otherwise terminated and creates replacements in batches spread across the given zones.
+    """
+
+    def __init__(self, manager, size, target, meta, labels, zones, image=None, batch=100, interval=60):
+        """
+        :param  manager: Manager used to list, create and destroy nodes.
+        :type   manager: :class:`ComputeEngineManager`
+
+        :param  size: The machine type to use.
+        :type   size: ``str``
+
+        :param  target: Amount of nodes the pool should hold.
+        :type   target: ``int``
+
+        :param  meta: Container VM kwargs as returned by build_container_vm().
+        :type   meta: ``dict``
+
+        :param  labels: Labels identifying the nodes of the pool.
+        :type   labels: ``dict``
+
+        :param  zones: Names of the zones to create nodes in.
+        :type   zones: ``list``
+
+        :param  image: The image used to create the disk - optional if the disks are part of `meta`.
+        :type   image: ``str``
+
+        :param  batch: Maximum amount of nodes created or destroyed per tick.
+        :type   batch: ``int``
+
+        :param  interval: Seconds between two ticks.
+        :type   interval: ``float``
+        """
+        if not labels:
+            raise ComputeEngineManagerException("A pool must be identified by labels.")
+        self.manager = manager
+        self.spec = PoolSpec(size, target, dict(meta, ex_labels=dict(meta.get('ex_labels') or {}, **labels)), labels,
+                             zones, image)
+        self.batch = batch
+        self.interval = interval
+        self.creating = OperationTracker(manager)
+        self.deleting = OperationTracker(manager)
+
+    def tick(self):
+        """List the pool once, destroy dead nodes and create missing nodes.
+
+        :return: State of the pool.
+        :rtype:  :class:`ReconcileStatus`
+        """
+        for tracker in (self.creating, self.deleting):
+            tracker.poll()
+            tracker.discard_completed()
+        deleting = {operation.target for operation in self.deleting.pending.values()}
+        creating = {operation.target for operation in self.creating.pending.values()}
+
+        spec = self.spec
+        nodes = self.manager.filter().labels(spec.labels).nodes
+        dead = [node for node in nodes if node.state == 'stopped' and node.name not in deleting]
+        alive = {node.name for node in nodes if node.state != 'stopped'} | creating
+
+        deleted = []
+        if dead:
+            batch = dead[:self.batch]
+            self.manager.logger.info("Destroying %d of %d terminated node%s of the pool.",
+                                     len(batch), len(dead), Common.pluralize(dead))
+            deleted = self.manager.submit_destroy(batch)
+            self.deleting.add(deleted)
+
+        created = []
+        missing = min(spec.target - len(alive), self.batch)
+        if missing > 0:
+            self.manager.logger.info("Creating %d node%s to replenish the pool.", missing, Common.pluralize(missing))
+            for zone, count in self.manager.spread(missing, spec.zones).items():
+                created.extend(self.manager.submit_create(spec.size, count, dict(spec.meta, location=zone),
+                                                          image=spec.image))
+            for operation in created:
+                if operation.error is not None:
+                    self.manager.logger.error("Node %s failed to create, code %s error: %s",
+                                              operation.target, operation.code, operation.error)
+            self.creating.add(created)
+
+        return ReconcileStatus(len(alive), len(dead), len(self.creating.pending), len(self.deleting.pending),
+                               len(created), len(deleted))
+
+    def run(self, ticks=None):
+        """Reconcile the pool until interrupted.
+
+        :param  ticks: Amount of ticks after which to stop, forever if None.
+        :type   ticks: ``int``
+        """
+        tick = 0
+        while ticks is None or tick < ticks:
+            try:
+                status = self.tick()
+            except (ComputeEngineManagerException, GoogleBaseError, socket.error) as error:
+                self.manager.logger.error("Reconciliation failed: %s", error)
+            else:
+                self.manager.logger.info("Pool: %d alive, %d dead, %d creating, %d deleting",
+                                         status.alive, status.dead, status.creating, status.deleting)
+            tick += 1
+            if ticks is None or tick < ticks:
+                time.sleep(self.interval)
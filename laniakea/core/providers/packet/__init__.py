@@ -8,9 +8,10 @@ import json
 import logging
 import argparse
 
+from laniakea.core.cache import JSONCache
 from laniakea.core.common import Focus
 from laniakea.core.userdata import UserData
-from .manager import PacketManager, PacketManagerException
+from .manager import PacketManager, PacketManagerException, SpotBidPlanner
 
 logger = logging.getLogger('laniakea')
 
@@ -46,19 +47,19 @@ class PacketCommandLine:
                        nargs='?',
                        const=-1,
                        metavar='n',
-                       help='Reboot active instances.')
+                       help='Reboot active instances, only the n newest if given.')
 
         g.add_argument('-stop',
                        nargs='?',
                        const=-1,
                        metavar='n',
-                       help='Stop active instances.')
+                       help='Stop active instances, only the n newest if given.')
 
         g.add_argument('-terminate',
                        nargs='?',
                        const=-1,
                        metavar='n',
-                       help='Terminate active instances.')
+                       help='Terminate active instances, only the n newest if given.')
 
         o = parser.add_argument_group('Optional Parameters') # pylint: disable=invalid-name
         o.add_argument('-create-volume',
@@ -66,6 +67,11 @@ class PacketCommandLine:
                        type=str,
                        metavar='s',
                        help='Create storage: <plan> <size> <region> <description>')
+        o.add_argument('-attach-volume',
+                       nargs=2,
+                       type=str,
+                       metavar='s',
+                       help='Attach a new volume to each created device: <plan> <size>')
 
         o.add_argument('-conf',
                        metavar='path',
@@ -73,6 +79,22 @@ class PacketCommandLine:
                        default=os.path.join(dirs.user_config_dir, 'examples', 'packet', 'packet.json'),
                        help='Packet configuration')
 
+        o.add_argument('-catalog-cache',
+                       metavar='path',
+                       type=str,
+                       default=os.path.join(dirs.user_cache_dir, 'packet', 'catalog.json'),
+                       help='Cache of plans, facilities, operating systems and spot prices.')
+
+        o.add_argument('-catalog-cache-ttl',
+                       metavar='#',
+                       type=int,
+                       default=86400,
+                       help='Seconds after which cached plans, facilities and operating systems expire.')
+
+        o.add_argument('-refresh-catalog',
+                       action='store_true',
+                       help='Ignore the catalog cache.')
+
         o.add_argument('-list-projects',
                        action='store_true',
                        help='List available projects.')
@@ -127,16 +149,59 @@ class PacketCommandLine:
                        type=float,
                        default='0.05',
                        help='Max price for spot instances.')
+        o.add_argument('-target-cores',
+                       metavar='#',
+                       type=int,
+                       help='Create spot devices with this amount of CPU cores at the lowest price.')
+        o.add_argument('-budget',
+                       metavar='#',
+                       type=float,
+                       help='Maximum total spot bid in USD per hour for -target-cores.')
+        o.add_argument('-facilities',
+                       metavar='seq',
+                       nargs='+',
+                       type=str,
+                       help='Facilities considered for -target-cores, all if omitted.')
+        o.add_argument('-plans',
+                       metavar='seq',
+                       nargs='+',
+                       type=str,
+                       help='Plans considered for -target-cores, all with known core counts if omitted.')
+        o.add_argument('-bid-factor',
+                       metavar='#',
+                       type=float,
+                       default=1.2,
+                       help='Spot bid for -target-cores as a multiple of the current price.')
         o.add_argument('-count',
                        metavar='#',
                        type=int,
                        default='1',
                        help='The amount of devices to be spawned.')
+        o.add_argument('-concurrency',
+                       metavar='#',
+                       type=int,
+                       default=16,
+                       help='Maximum amount of concurrent device operations.')
+        o.add_argument('-batch',
+                       action='store_true',
+                       help='Create devices with a single batch request.')
+        o.add_argument('-wait',
+                       action='store_true',
+                       help='Wait for created devices to become active and print them as they do.')
+        o.add_argument('-wait-timeout',
+                       metavar='#',
+                       type=int,
+                       default=1800,
+                       help='Seconds to wait for created devices to become active.')
         o.add_argument('-only',
                        metavar='k=v',
                        nargs='+',
                        type=str,
                        help='Filter instances by criterias.')
+        o.add_argument('-match',
+                       choices=['any', 'all'],
+                       default='any',
+                       help='Whether devices must match any or all -only criterias.')
         o.add_argument('-version',
                        action='version',
                        version='%(prog)s {}'.format(cls.VERSION),
@@ -168,7 +233,8 @@ class PacketCommandLine:
 
         # Packet Manager
         try:
-            cluster = PacketManager(conf)
+            cluster = PacketManager(conf, args.concurrency,
+                                    JSONCache(args.catalog_cache, args.catalog_cache_ttl, args.refresh_catalog))
         except PacketManagerException as msg:
             logger.error(msg)
             return 1
@@ -191,7 +257,7 @@ class PacketCommandLine:
             cluster.print_facilities(cluster.list_facilities())
 
         if args.list_devices and args.project:
-            cluster.print_devices(cluster.list_devices(project, conditions=args.only))
+            cluster.print_devices(cluster.iter_devices(project, conditions=args.only, mode=args.match))
 
         if args.create_volume:
             if len(args.create_volume) < 4:
@@ -204,11 +270,35 @@ class PacketCommandLine:
                 logger.error(msg)
                 return 1
 
-        # Device Pre-Checks
-        if (args.create_spot or args.create_demand) \
-                and (args.region and args.plan):
+        created = []
+        incomplete = False
+
+        # Cost-optimal spot devices across facilities and plans.
+        if args.create_spot and args.target_cores:
+            try:
+                allocations = SpotBidPlanner(cluster, bid_factor=args.bid_factor).plan(
+                    args.target_cores, args.budget, args.facilities, args.plans)
+                for allocation in allocations:
+                    cluster.validate_create(allocation.facility, allocation.plan, args.os)
+                for allocation in allocations:
+                    logger.info('Bidding %.4f USD/h for %d x %s in %s (current price %.4f USD/h)',
+                                allocation.bid, allocation.count, allocation.plan, allocation.facility,
+                                allocation.price)
+                report = cluster.create_spot_plan(project, allocations, args.os, tags=args.tags, userdata=userdata,
+                                                  batch=args.batch)
+            except PacketManagerException as msg:
+                logger.error(msg)
+                return 1
+            created.extend(report.results)
+            if report.failed:
+                logger.error('%d devices failed to create.', len(report.failed))
+                incomplete = True
+
+        elif (args.create_spot or args.create_demand) and args.region and args.plan:
+            # Device Pre-Checks
             logging.info('Validating requested remote capacities ...')
             try:
+                cluster.validate_create(args.region, args.plan, args.os)
                 status = cluster.validate_capacity([
                     [args.region, args.plan, str(args.count)]
                 ])
@@ -218,63 +308,82 @@ class PacketCommandLine:
                 logger.error(msg)
                 return 1
 
-        # Device Creation
-        if args.create_spot \
-                and args.region \
-                and args.plan \
-                and args.max_spot_price \
-                and args.os:
+            # Device Creation
+            if args.create_spot and args.max_spot_price and args.os:
+                try:
+                    devices = cluster.create_spot(project_id=project,
+                                                  facility=args.region,
+                                                  plan=args.plan,
+                                                  operating_system=args.os,
+                                                  spot_price_max=args.max_spot_price,
+                                                  tags=args.tags,
+                                                  userdata=userdata,
+                                                  count=args.count,
+                                                  batch=args.batch)
+                    created.extend(devices)
+                except PacketManagerException as msg:
+                    logger.error(msg)
+                    return 1
+
+            if args.create_demand and args.os:
+                try:
+                    devices = cluster.create_demand(project_id=project,
+                                                    facility=args.region,
+                                                    plan=args.plan,
+                                                    tags=args.tags,
+                                                    operating_system=args.os,
+                                                    userdata=userdata,
+                                                    count=args.count,
+                                                    batch=args.batch)
+                    created.extend(devices)
+                except PacketManagerException as msg:
+                    logger.error(msg)
+                    return 1
+
+        if created and args.attach_volume:
+            [plan, size] = args.attach_volume
+            logger.info('Attaching %s GB of %s storage to %d devices once active.', size, plan, len(created))
             try:
-                devices = cluster.create_spot(project_id=project,
-                                              facility=args.region,
-                                              plan=args.plan,
-                                              operating_system=args.os,
-                                              spot_price_max=args.max_spot_price,
-                                              tags=args.tags,
-                                              userdata=userdata,
-                                              count=args.count)
-                cluster.print_devices(devices)
-            except PacketManagerException as msg:
+                report = cluster.provision_volumes(project, created, plan, int(size), timeout=args.wait_timeout)
+            except (PacketManagerException, ValueError) as msg:
                 logger.error(msg)
                 return 1
-
-        if args.create_demand \
-                and args.region \
-                and args.plan \
-                and args.os:
-            try:
-                devices = cluster.create_demand(project_id=project,
-                                                facility=args.region,
-                                                plan=args.plan,
-                                                tags=args.tags,
-                                                operating_system=args.os,
-                                                userdata=userdata,
-                                                count=args.count)
-                cluster.print_devices(devices)
-            except PacketManagerException as msg:
-                logger.error(msg)
+            cluster.print_devices(report.succeeded)
+            for device, reason in report.failed:
+                logger.error('%s: %s', device.hostname, reason)
+            if report.failed:
                 return 1
-
-        # Device Operations
-        if args.reboot:
+        elif created and not args.wait:
+            cluster.print_devices(created)
+        elif created:
+            logger.info('Waiting up to %ds for %d devices to become active.', args.wait_timeout, len(created))
+            waiter = cluster.wait_for_devices(project, created, timeout=args.wait_timeout)
             try:
-                cluster.reboot(cluster.list_devices(project, conditions=args.only))
+                for device in waiter:
+                    cluster.print_devices([device])
             except PacketManagerException as msg:
                 logger.error(msg)
                 return 1
-
-        if args.stop:
-            try:
-                cluster.stop(cluster.list_devices(project, conditions=args.only))
-            except PacketManagerException as msg:
-                logger.error(msg)
+            logger.info(waiter.report.summary())
+            for device, reason in waiter.report.failed + waiter.report.skipped:
+                logger.error('%s: %s', device.hostname, reason)
+            if waiter.report.failed or waiter.report.skipped:
                 return 1
+        if incomplete:
+            return 1
 
-        if args.terminate:
+        # Device Operations
+        for operation in ('reboot', 'stop', 'terminate'):
+            count = getattr(args, operation)
+            if not count:
+                continue
             try:
-                cluster.terminate(cluster.list_devices(project, conditions=args.only))
-            except PacketManagerException as msg:
+                devices = cluster.list_devices(project, conditions=args.only, mode=args.match)
+                report = cluster.power(operation, devices, int(count))
+            except (PacketManagerException, ValueError) as msg:
                 logger.error(msg)
                 return 1
+            if report.failed:
+                return 1
 
         return 0
@@ -3,15 +3,25 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 """Packet Bare Metal API"""
+import math
+import functools
 import logging
+import re
 import sys
+import time
+import collections
 import pprint
 import random
+import concurrent.futures
+
+from laniakea.core.executor import BoundedExecutor, OperationReport
+from laniakea.core.retry import ErrorClass, RetryPolicy, TokenBucket
 
 logger = logging.getLogger('laniakea')
 
 try:
     import packet
+    import requests
 except ImportError as msg:
     logger.error(msg)
     sys.exit(-1)
@@ -21,6 +31,304 @@ class PacketManagerException(Exception):
     """Exception class for Packet Manager."""
 
 
+PACKET_API_BUCKET = TokenBucket(rate=10, capacity=20)
+
+
+def classify_packet_error(error):
+    """Classify errors raised by packet-python for the retry policy of PacketManager.
+    """
+    if not isinstance(error, packet.baseapi.Error):
+        return ErrorClass.FATAL
+    if isinstance(error.cause, requests.exceptions.ConnectionError):
+        return ErrorClass.TRANSIENT
+    match = re.match(r'Error (\d{3})', str(error))
+    if match:
+        status = int(match.group(1))
+        if status == 429:
+            return ErrorClass.THROTTLED
+        if status >= 500:
+            return ErrorClass.TRANSIENT
+    return ErrorClass.FATAL
+
+
+def classify_packet_create_error(error):
+    """Classify errors raised while creating resources, only throttled requests are safe to repeat.
+    """
+    error_class = classify_packet_error(error)
+    return error_class if error_class == ErrorClass.THROTTLED else ErrorClass.FATAL
+
+
+class DeviceMatcher:
+    """Predicate compiled from -only criterias which matches devices as returned by the API.
+
+    Criteria names may be dotted paths into nested fields, i.e. "plan.slug". Each criteria matches if the
+    field, or any item of a list field, equals one of its values. Depending on `mode` a device matches if
+    any or all criterias match.
+    """
+
+    def __init__(self, criterias, mode='any'):
+        if mode not in ('any', 'all'):
+            raise PacketManagerException('Unknown match mode "{}"'.format(mode))
+        self.mode = mode
+        self.criterias = []
+        for name, values in criterias.items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            self.criterias.append((name.split('.'), frozenset(self.normalize(value) for value in values)))
+
+    @staticmethod
+    def normalize(value):
+        """Canonical string representation of a field or criteria value.
+        """
+        if isinstance(value, bool):
+            return str(value).lower()
+        if isinstance(value, str) and value.lower() in ('true', 'false'):
+            return value.lower()
+        return str(value)
+
+    def matches(self, path, values, device):
+        field = device
+        for key in path:
+            if not isinstance(field, dict) or key not in field:
+                return False
+            field = field[key]
+        if isinstance(field, list):
+            return any(not isinstance(item, (dict, list)) and self.normalize(item) in values for item in field)
+        if field is None or isinstance(field, dict):
+            return False
+        return self.normalize(field) in values
+
+    def __call__(self, device):
+        if self.mode == 'all':
+            return all(self.matches(path, values, device) for path, values in self.criterias)
+        return any(self.matches(path, values, device) for path, values in self.criterias)
+
+
+SpotAllocation = collections.namedtuple('SpotAllocation', ['facility', 'plan', 'count', 'price', 'bid', 'cores'])
+
+
+class SpotBidPlanner:
+    """Choose the cheapest mix of facilities and plans on the spot market for a target amount of CPU cores.
+
+    The API reports CPU sockets of a plan but no core counts, therefore core counts of known plans are kept
+    in `PLAN_CORES` and can be extended with the `cores` argument.
+    """
+    PLAN_CORES = {
+        'baremetal_0': 4,
+        'baremetal_1': 4,
+        'baremetal_1e': 4,
+        'baremetal_2': 24,
+        'baremetal_2a': 96,
+        'baremetal_3': 16,
+        'baremetal_s': 16,
+        'c1.small.x86': 4,
+        'c1.large.arm': 96,
+        'c1.xlarge.x86': 16,
+        'c2.medium.x86': 24,
+        'c2.large.arm': 32,
+        'm1.xlarge.x86': 24,
+        'm2.xlarge.x86': 28,
+        'n2.xlarge.x86': 28,
+        't1.small.x86': 4,
+        'x1.small.x86': 4,
+    }
+
+    def __init__(self, manager, cores=None, bid_factor=1.2):
+        """
+        :param manager: Manager used to request prices and validate capacities.
+        :type manager: :class:`PacketManager`
+        :param cores: Core counts by plan in addition to `PLAN_CORES`.
+        :type cores: dict
+        :param bid_factor: Maximum bid as a multiple of the current spot price.
+        :type bid_factor: float
+        """
+        self.manager = manager
+        self.cores = dict(self.PLAN_CORES, **(cores or {}))
+        self.bid_factor = bid_factor
+
+    def price_table(self):
+        """Parse the spot market prices into a compact table.
+
+        :return: Current price in USD per hour by facility and plan.
+        :rtype: dict
+        """
+        try:
+            prices = self.manager.list_spot_prices() or {}
+        except packet.baseapi.Error as msg:
+            raise PacketManagerException(msg)
+        table = {}
+        for facility, plans in prices.get('spot_market_prices', {}).items():
+            for plan, info in plans.items():
+                if isinstance(info, dict) and info.get('price') is not None:
+                    table[(facility, plan)] = float(info['price'])
+        return table
+
+    def candidates(self, facilities=None, plans=None):
+        """Facility and plan combinations with known core counts, cheapest per core first.
+
+        :return: Tuples of (facility, plan, price, cores).
+        :rtype: list
+        """
+        result = []
+        for (facility, plan), price in self.price_table().items():
+            if facilities and facility not in facilities or plans and plan not in plans:
+                continue
+            if plan not in self.cores or price <= 0:
+                continue
+            result.append((facility, plan, price, self.cores[plan]))
+        result.sort(key=lambda candidate: (candidate[2] / candidate[3], candidate[2]))
+        return result
+
+    def allocate(self, candidates, target_cores, budget, max_per_option=None):
+        """Greedily fill the target amount of cores with the cheapest candidates within the hourly budget.
+
+        :return: Allocations, cheapest per core first.
+        :rtype: list of :class:`SpotAllocation`
+        """
+        allocations = []
+        remaining_cores = target_cores
+        remaining_budget = budget
+        for facility, plan, price, cores in candidates:
+            if remaining_cores <= 0:
+                break
+            bid = round(price * self.bid_factor, 4)
+            count = int(math.ceil(remaining_cores / float(cores)))
+            if budget is not None:
+                count = min(count, int(remaining_budget // bid))
+            if max_per_option is not None:
+                count = min(count, max_per_option)
+            if count <= 0:
+                continue
+            allocations.append(SpotAllocation(facility, plan, count, price, bid, cores))
+            remaining_cores -= count * cores
+            if budget is not None:
+                remaining_budget -= count * bid
+        return allocations
+
+    def plan(self, target_cores, budget=None, facilities=None, plans=None, max_per_option=None):
+        """Plan the cheapest mix of spot devices which provides the target amount of cores.
+
+        The capacity of all chosen options is validated with a single request. Only if the whole mix can not
+        be fulfilled, options are validated one by one and those without capacity are replaced.
+
+        :param target_cores: Amount of CPU cores to acquire.
+        :type target_cores: int
+        :param budget: Maximum total bid in USD per hour, unlimited if None.
+        :type budget: float
+        :param facilities: Facilities to consider, all if None.
+        :type facilities: list
+        :param plans: Plans to consider, all plans with known core counts if None.
+        :type plans: list
+        :param max_per_option: Maximum amount of devices of a single facility and plan.
+        :type max_per_option: int
+        :return: Allocations, cheapest per core first.
+        :rtype: list of :class:`SpotAllocation`
+        """
+        candidates = self.candidates(facilities, plans)
+        while True:
+            allocations = self.allocate(candidates, target_cores, budget, max_per_option)
+            if not allocations:
+                raise PacketManagerException('No spot market offers match the requested cores and budget.')
+            if self.manager.validate_capacity([[a.facility, a.plan, str(a.count)] for a in allocations]):
+                break
+            unavailable = {(a.facility, a.plan) for a in allocations
+                           if not self.manager.validate_capacity([[a.facility, a.plan, str(a.count)]])}
+            if not unavailable:
+                break
+            logger.info('No spot capacity for %s', ', '.join('%s in %s' % (p, f) for f, p in sorted(unavailable)))
+            candidates = [c for c in candidates if (c[0], c[1]) not in unavailable]
+
+        provided = sum(a.count * a.cores for a in allocations)
+        if provided < target_cores:
+            logger.warning('The budget only suffices for %d of %d cores.', provided, target_cores)
+        return allocations
+
+
+class DeviceWaiter:
+    """Wait for many devices to become active with one paginated project listing per tick.
+
+    Iterating over the waiter yields devices as soon as they are active. Afterwards, :attr:`report` holds
+    active devices as succeeded, failed or vanished devices as failed and devices which were still not
+    active at the deadline as skipped.
+    """
+    READY_STATES = frozenset(['active'])
+    FAILED_STATES = frozenset(['failed'])
+    # Ticks a device may be absent from the listing before it is considered gone.
+    MISSING_TICKS = 3
+
+    def __init__(self, manager, project_id, devices, timeout=1800, poll_interval=10):
+        """
+        :param manager: Manager used to list the devices.
+        :type manager: :class:`PacketManager`
+        :param project_id: Project of the devices.
+        :type project_id: str
+        :param devices: Devices to wait for.
+        :type devices: list
+        :param timeout: Seconds to wait for all devices.
+        :type timeout: int
+        :param poll_interval: Seconds between two listings.
+        :type poll_interval: int
+        """
+        self.listing = functools.partial(manager.list_devices, project_id)
+        self.pending = collections.OrderedDict((device.id, device) for device in devices)
+        self.states = {device.id: device.state for device in devices}
+        self.missing = collections.Counter()
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.report = OperationReport('wait')
+
+    def poll(self):
+        """List the project once and update the state of all pending devices.
+
+        A listing which failed with a transient error is skipped until the next poll.
+
+        :return: Devices which became active.
+        :rtype: list
+        """
+        seen = set()
+        ready = []
+        try:
+            devices = self.listing()
+        except packet.baseapi.Error as msg:
+            if classify_packet_error(msg) == ErrorClass.FATAL:
+                raise PacketManagerException(msg)
+            logger.warning('Unable to list devices, trying again: %s', msg)
+            return ready
+        for device in devices:
+            if device.id not in self.pending:
+                continue
+            seen.add(device.id)
+            if device.state != self.states.get(device.id):
+                logger.info('Device %s: %s -> %s', device.id, self.states.get(device.id), device.state)
+                self.states[device.id] = device.state
+            if device.state in self.READY_STATES:
+                del self.pending[device.id]
+                self.report.success(device)
+                ready.append(device)
+            elif device.state in self.FAILED_STATES:
+                del self.pending[device.id]
+                self.report.failure(device, 'Device {}'.format(device.state))
+        for device_id in [device_id for device_id in self.pending if device_id not in seen]:
+            self.missing[device_id] += 1
+            if self.missing[device_id] >= self.MISSING_TICKS:
+                self.report.failure(self.pending.pop(device_id), 'Device disappeared')
+        return ready
+
+    def __iter__(self):
+        deadline = time.monotonic() + self.timeout
+        while self.pending:
+            for device in self.poll():
+                yield device
+            if not self.pending:
+                break
+            if time.monotonic() >= deadline:
+                for device in self.pending.values():
+                    self.report.skip(device, 'Not active after {}s, last state {}'.format(
+                        self.timeout, self.states.get(device.id)))
+                self.pending.clear()
+                break
+            time.sleep(self.poll_interval)
+
+
 class PacketConfiguration:
     """Packet configuration class.
     """
@@ -49,17 +357,29 @@ class PacketConfiguration:
             raise PacketManagerException('One or more projects are not setup appropriately.')
 
 
-class PacketManager:
+# The API connection, both retry policies, the worker limit and the catalog are shared by all requests.
+class PacketManager:  # pylint: disable=too-many-instance-attributes
     """PacketManager base class.
     """
-
-    def __init__(self, conf):
+    # Facility values which let the API choose a facility.
+    ANY_FACILITIES = frozenset(['any'])
+    BATCH_PENDING_STATES = frozenset(['queued', 'processing'])
+    VOLUME_READY_STATES = frozenset(['active'])
+    VOLUME_FAILED_STATES = frozenset(['failed'])
+    PAGE_SIZE = 1000
+    SPOT_PRICE_TTL = 300
+
+    def __init__(self, conf, max_workers=16, catalog=None):
         self.logger = logging.getLogger(self.__class__.__name__)
         PacketConfiguration(conf).validate()
         self.conf = conf
         self.auth_token = self.conf.get('auth_token')
         self.manager = packet.Manager(auth_token=self.auth_token)
         self.api = self.manager.call_api
+        self.retry = RetryPolicy(classify_packet_error, bucket=PACKET_API_BUCKET)
+        self.create_retry = RetryPolicy(classify_packet_create_error, bucket=PACKET_API_BUCKET)
+        self.max_workers = max_workers
+        self.catalog = catalog
 
     def pprint(self, data):
         """Pretty print JSON.
@@ -71,7 +391,7 @@ class PacketManager:
         """
         if params is None:
             params = {}
-        return self.manager.list_projects(params)
+        return self.retry(self.manager.list_projects, params)
 
     def print_projects(self, projects):
         """Print method for projects.
@@ -79,12 +399,22 @@ class PacketManager:
         for project in projects:
             print('{}: {}'.format(project.name, project.id))
 
+    def fetch_catalog(self, path, ttl=None):
+        """Retrieve a catalog collection from the cache if configured and fresh, otherwise from the API.
+        """
+        data = self.catalog.get(path, ttl) if self.catalog is not None else None
+        if data is None:
+            data = self.retry(self.api, path)
+            if self.catalog is not None:
+                self.catalog.update({path: data})
+        return data
+
     def list_operating_systems(self, params=None):
         """Retrieve list of available operating systems.
         """
-        if params is None:
-            params = {}
-        return self.manager.list_operating_systems(params)
+        if params:
+            return self.retry(self.manager.list_operating_systems, params)
+        return [packet.OperatingSystem(data) for data in self.fetch_catalog('operating-systems')['operating_systems']]
 
     def print_operating_systems(self, operating_systems):
         """Print method for operating systems.
@@ -95,9 +425,9 @@ class PacketManager:
     def list_plans(self, params=None):
         """Retrieve list of available plans.
         """
-        if params is None:
-            params = {}
-        return self.manager.list_plans(params)
+        if params:
+            return self.retry(self.manager.list_plans, params)
+        return [packet.Plan(data) for data in self.fetch_catalog('plans')['plans']]
 
     def print_plans(self, plans):
         """Print method for plans.
@@ -110,9 +440,9 @@ class PacketManager:
     def list_facilities(self, params=None):
         """Retrieve list of available facilities.
         """
-        if params is None:
-            params = {}
-        return self.manager.list_facilities(params)
+        if params:
+            return self.retry(self.manager.list_facilities, params)
+        return [packet.Facility(data) for data in self.fetch_catalog('facilities')['facilities']]
 
     def print_facilities(self, facilities):
         """Print method for facilities.
@@ -123,25 +453,66 @@ class PacketManager:
     def list_spot_prices(self):
         """Retrieve list of current spot market prices.
         """
-        prices = self.api('market/spot/prices')
-        return prices
+        return self.fetch_catalog('market/spot/prices', self.SPOT_PRICE_TTL)
+
+    def validate_create(self, facility, plan, operating_system):
+        """Validate facility, plan and operating system of new devices against the catalog.
+        """
+        try:
+            facilities = {item.code for item in self.list_facilities()}
+            plans = {item.slug for item in self.list_plans()}
+            systems = {item.slug: item for item in self.list_operating_systems()}
+        except packet.baseapi.Error as msg:
+            raise PacketManagerException(msg)
+        if facility not in facilities and facility not in self.ANY_FACILITIES:
+            raise PacketManagerException('Unknown facility "{}", available: {}'.format(
+                facility, ', '.join(sorted(facilities))))
+        if plan not in plans:
+            raise PacketManagerException('Unknown plan "{}", available: {}'.format(plan, ', '.join(sorted(plans))))
+        if operating_system not in systems:
+            raise PacketManagerException('Unknown operating system "{}", available: {}'.format(
+                operating_system, ', '.join(sorted(systems))))
+        if plan not in (systems[operating_system].provisionable_on or [plan]):
+            raise PacketManagerException('Operating system "{}" can not be provisioned on plan "{}"'.format(
+                operating_system, plan))
 
     def print_spot_prices(self, spot_prices):
         """Print method for spot prices.
         """
         self.pprint(spot_prices)
 
-    def list_devices(self, project_id, conditions=None, params=None):
+    def list_devices(self, project_id, conditions=None, params=None, mode='any'):
         """Retrieve list of devices in a project by one of more conditions.
         """
-        default_params = {'per_page': 1000}
+        return list(self.iter_devices(project_id, conditions, params, mode=mode))
+
+    def iter_devices(self, project_id, conditions=None, params=None, prefetch=True, mode='any'):
+        """Iterate over all pages of devices in a project, filtered page by page by one or more conditions.
+
+        While the devices of a page are consumed, the next page is requested in the background if `prefetch`
+        is set.
+        """
+        default_params = {'per_page': self.PAGE_SIZE}
         if params:
             default_params.update(params)
-        data = self.api('projects/%s/devices' % project_id, params=default_params)
-        devices = []
-        for device in self.filter(conditions, data['devices']):
-            devices.append(packet.Device(device, self.manager))
-        return devices
+        matcher = DeviceMatcher(conditions, mode) if conditions else None
+
+        def fetch(page):
+            return self.retry(self.api, 'projects/%s/devices' % project_id, params=dict(default_params, page=page))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            page = default_params.get('page', 1)
+            data = fetch(page)
+            while True:
+                meta = data.get('meta') or {}
+                last_page = meta.get('last_page') or page
+                following = pool.submit(fetch, page + 1) if prefetch and page < last_page else None
+                for device in self.filter(matcher, data['devices']):
+                    yield packet.Device(device, self.manager)
+                if page >= last_page:
+                    break
+                page += 1
+                data = following.result() if following is not None else fetch(page)
 
     def print_devices(self, devices):
         """Print method for devices.
@@ -156,31 +527,13 @@ class PacketManager:
                           device.tags))
 
     @staticmethod
-    def filter(criterias, devices):  # pylint: disable=too-many-branches
-        """Filter a device by criterias on the root level of the dictionary.
+    def filter(criterias, devices, mode='any'):
+        """Filter devices by criterias, each device is returned at most once.
         """
         if not criterias:
             return devices
-        result = []
-        for device in devices:  # pylint: disable=too-many-nested-blocks
-            for criteria_name, criteria_values in criterias.items():
-                if criteria_name in device.keys():
-                    if isinstance(device[criteria_name], list):
-                        for criteria_value in criteria_values:
-                            if criteria_value in device[criteria_name]:
-                                result.append(device)
-                                break
-                    elif isinstance(device[criteria_name], str):
-                        for criteria_value in criteria_values:
-                            if criteria_value == device[criteria_name]:
-                                result.append(device)
-                    elif isinstance(device[criteria_name], int):
-                        for criteria_value in criteria_values:
-                            if criteria_value == device[criteria_name]:
-                                result.append(device)
-                    else:
-                        continue
-        return result
+        matcher = criterias if isinstance(criterias, DeviceMatcher) else DeviceMatcher(criterias, mode)
+        return [device for device in devices if matcher(device)]
 
     @staticmethod
     def get_random_hostname():
@@ -223,6 +576,201 @@ class PacketManager:
             raise PacketManagerException(msg)
         return volume
 
+    def wait_for_volume(self, volume, timeout=600, poll_interval=5):
+        """Wait for a volume to become active.
+
+        :param volume: The volume.
+        :param timeout: Seconds to wait for the volume.
+        :return: The volume.
+        """
+        deadline = time.monotonic() + timeout
+        state = volume.state
+        while state not in self.VOLUME_READY_STATES:
+            if state in self.VOLUME_FAILED_STATES or time.monotonic() >= deadline:
+                raise PacketManagerException('Volume {} is {}'.format(volume.id, state))
+            time.sleep(poll_interval)
+            try:
+                state = self.retry(self.api, 'storage/%s' % volume.id)['state']
+            except packet.baseapi.Error as msg:
+                raise PacketManagerException(msg)
+        return volume
+
+    def provision_volumes(self, project_id, devices, plan, size, label='scratch', timeout=1800, poll_interval=10):
+        """Create a volume for each device while the devices boot and attach it as soon as both are active.
+
+        Volumes which are not attached in the end are deleted again, also if waiting for the devices fails.
+
+        :param devices: Devices which were just created.
+        :param label: Prefix of the volume descriptions, followed by the hostname of the device.
+        :param timeout: Seconds to wait for the devices and volumes to become active.
+        :return: Devices with an attached volume as succeeded and the volumes as results.
+        :rtype: :class:`OperationReport`
+        """
+        report = OperationReport('attach volume')
+        attached = set()
+
+        def create(device):
+            return self.create_retry(self.manager.create_volume, project_id, '%s-%s' % (label, device.hostname),
+                                     plan, size, device.facility['code'])
+
+        def attach(device, creation):
+            try:
+                volume = self.wait_for_volume(creation.result(), timeout)
+                # The attachment is posted directly, the volume is already known.
+                self.create_retry(self.api, 'storage/%s/attachments' % volume.id, type='POST',
+                                  params={'device_id': device.id})
+            except (packet.baseapi.Error, PacketManagerException, concurrent.futures.CancelledError) as msg:
+                self.logger.error('Unable to attach a volume to %s: %s', device.id, msg or repr(msg))
+                report.failure(device, msg)
+                return
+            attached.add(device.id)
+            report.success(device, volume)
+
+        # Attachments wait for creations, so both must not compete for the same workers.
+        creator = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        attacher = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        creations = collections.OrderedDict((device.id, creator.submit(create, device)) for device in devices)
+        yielded = set()
+        waiter = self.wait_for_devices(project_id, devices, timeout, poll_interval)
+        try:
+            for device in waiter:
+                yielded.add(device.id)
+                attacher.submit(attach, device, creations[device.id])
+        finally:
+            # Volumes of devices which never became active are not needed.
+            for device_id, creation in creations.items():
+                if device_id not in yielded:
+                    creation.cancel()
+            attacher.shutdown(wait=True)
+            creator.shutdown(wait=True)
+            self._delete_unattached_volumes(creations, attached)
+
+        for device, reason in waiter.report.failed + waiter.report.skipped:
+            report.failure(device, reason)
+        self.logger.info(report.summary())
+        return report
+
+    def _delete_unattached_volumes(self, creations, attached):
+        for device_id, creation in creations.items():
+            if device_id in attached or creation.cancelled() or creation.exception() is not None:
+                continue
+            volume = creation.result()
+            try:
+                self.retry_delete(volume.delete)
+            except packet.baseapi.Error as msg:
+                self.logger.error('Unable to delete unattached volume %s of %s: %s', volume.id, device_id, msg)
+            else:
+                self.logger.info('Deleted unattached volume %s of %s', volume.id, device_id)
+
+    def provision(self, project_id, facility, plan, operating_system, count=1, hostname=None, tags=None,
+                  userdata='', spot_price_max=None, batch=False, timeout=600):
+        """Create many devices concurrently and report the outcome for each hostname.
+
+        :param batch: Use the batch endpoint of the API which creates all devices with a single request.
+        :param spot_price_max: Maximum bid for spot devices, on demand devices are created if None.
+        :param timeout: Seconds to wait for a batch to be processed.
+        :return: Succeeded hostnames with the created devices as results.
+        :rtype: :class:`OperationReport`
+        """
+        tags = {} if tags is None else tags
+        hostname = self.get_random_hostname() if hostname is None else hostname
+        hostnames = [hostname] if count == 1 else ['%s-%d' % (hostname, i) for i in range(1, count + 1)]
+        params = {
+            'facility': facility,
+            'plan': plan,
+            'operating_system': operating_system,
+            'tags': tags,
+            'userdata': userdata,
+        }
+        if spot_price_max is not None:
+            params.update(spot_instance=True, spot_price_max=spot_price_max)
+        self.logger.info('Adding %d device%s to project %s: %s, %s, %s, %s, %r',
+                         count, 's' if count > 1 else '', project_id, facility,
+                         plan, operating_system, 'spot' if spot_price_max is not None else 'on-demand', tags)
+
+        if batch:
+            return self._provision_batch(project_id, hostnames, params, timeout)
+
+        def create(new_hostname):
+            return self.manager.create_device(project_id=project_id, hostname=new_hostname, **params)
+
+        executor = BoundedExecutor(self.max_workers, retry=self.create_retry)
+        return executor.run(create, hostnames, operation='create')
+
+    def _provision_batch(self, project_id, hostnames, params, timeout):
+        report = OperationReport('create')
+        try:
+            data = self.create_retry(self.api, 'projects/%s/devices/batch' % project_id, type='POST',
+                                     params={'batches': [dict(params, hostnames=hostnames, quantity=len(hostnames))]})
+        except packet.baseapi.Error as msg:
+            for hostname in hostnames:
+                report.failure(hostname, msg)
+            return report
+
+        deadline = time.monotonic() + timeout
+        created = {}
+        errors = []
+        for batch in data.get('batches', []):
+            while True:
+                batch = self.retry(self.api, 'batches/%s' % batch['id'], params={'include': 'devices'})
+                if batch.get('state') not in self.BATCH_PENDING_STATES or time.monotonic() >= deadline:
+                    break
+                time.sleep(5)
+            for device in batch.get('devices', []):
+                if 'hostname' in device:
+                    device = packet.Device(device, self.manager)
+                else:
+                    device = self.retry(self.manager.get_device, device['href'].rsplit('/', 1)[-1])
+                created[device.hostname] = device
+            errors.extend(batch.get('error_messages') or [])
+
+        for hostname in hostnames:
+            if hostname in created:
+                report.success(hostname, created[hostname])
+            else:
+                report.failure(hostname, '; '.join(errors) or 'Device was not created in time.')
+        return report
+
+    def create_spot_plan(self, project_id, allocations, operating_system, tags=None, userdata='', hostname=None,
+                         batch=False):
+        """Create spot devices across facilities and plans as planned by :class:`SpotBidPlanner`.
+
+        :return: Succeeded hostnames with the created devices as results.
+        :rtype: :class:`OperationReport`
+        """
+        hostname = self.get_random_hostname() if hostname is None else hostname
+
+        def create(item):
+            index, allocation = item
+            return self.provision(project_id, allocation.facility, allocation.plan, operating_system,
+                                  allocation.count, hostname='%s-%s%d' % (hostname, allocation.facility, index),
+                                  tags=tags, userdata=userdata, spot_price_max=allocation.bid, batch=batch)
+
+        partials = BoundedExecutor(len(allocations) or 1).run(create, list(enumerate(allocations)), operation='create')
+        report = OperationReport('create')
+        for (_, allocation), error in partials.failed:
+            report.failure(allocation, error)
+        for partial in partials.results:
+            for created_hostname, device in zip(partial.succeeded, partial.results):
+                report.success(created_hostname, device)
+            for failed_hostname, error in partial.failed:
+                report.failure(failed_hostname, error)
+        return report
+
+    def wait_for_devices(self, project_id, devices, timeout=1800, poll_interval=10):
+        """Create a waiter which yields the given devices as they become active.
+
+        :rtype: :class:`DeviceWaiter`
+        """
+        return DeviceWaiter(self, project_id, devices, timeout, poll_interval)
+
+    def _created_devices(self, report):
+        for hostname, error in report.failed:
+            self.logger.error('Unable to create device %s: %s', hostname, error)
+        if report.failed and not report.succeeded:
+            raise PacketManagerException(report.failed[0][1])
+        return report.results
+
     def create_demand(self,
                       project_id,
                       facility,
@@ -231,33 +779,12 @@ class PacketManager:
                       tags=None,
                       userdata='',
                       hostname=None,
-                      count=1):
-        """Create a new on demand device under the given project.
+                      count=1,
+                      batch=False):
+        """Create new on demand devices under the given project.
         """
-        tags = {} if tags is None else tags
-        hostname = self.get_random_hostname() if hostname is None else hostname
-        devices = []
-        for i in range(1, count + 1):
-            new_hostname = hostname if count == 1 else hostname + '-' + str(i)
-            self.logger.info('Adding to project %s: %s, %s, %s, %s, %r',
-                             project_id,
-                             new_hostname,
-                             facility,
-                             plan,
-                             operating_system,
-                             tags)
-            try:
-                device = self.manager.create_device(project_id=project_id,
-                                                    hostname=new_hostname,
-                                                    facility=facility,
-                                                    plan=plan,
-                                                    tags=tags,
-                                                    userdata=userdata,
-                                                    operating_system=operating_system)
-                devices.append(device)
-            except packet.baseapi.Error as msg:
-                raise PacketManagerException(msg)
-        return devices
+        return self._created_devices(self.provision(project_id, facility, plan, operating_system, count,
+                                                    hostname=hostname, tags=tags, userdata=userdata, batch=batch))
 
     def create_spot(self,
                     project_id,
@@ -268,63 +795,82 @@ class PacketManager:
                     tags=None,
                     userdata='',
                     hostname=None,
-                    count=1):
-        """Create a new spot device under the given project.
+                    count=1,
+                    batch=False):
+        """Create new spot devices under the given project.
         """
-        tags = {} if tags is None else tags
-        hostname = self.get_random_hostname() if hostname is None else hostname
-        devices = []
-        for i in range(1, count + 1):
-            new_hostname = hostname if count == 1 else hostname + '-' + str(i)
-            try:
-                self.logger.info('Adding to project %s: %s, %s, %f, %s, %s, %r',
-                                 project_id,
-                                 new_hostname,
-                                 facility,
-                                 spot_price_max,
-                                 plan,
-                                 operating_system,
-                                 tags)
-                device = self.manager.create_device(project_id=project_id,
-                                                    hostname=new_hostname,
-                                                    facility=facility,
-                                                    spot_price_max=spot_price_max,
-                                                    spot_instance=True,
-                                                    plan=plan,
-                                                    tags=tags,
-                                                    userdata=userdata,
-                                                    operating_system=operating_system)
-                devices.append(device)
-            except packet.baseapi.Error as msg:
-                raise PacketManagerException(msg)
-        return devices
+        return self._created_devices(self.provision(project_id, facility, plan, operating_system, count,
+                                                    hostname=hostname, tags=tags, userdata=userdata,
+                                                    spot_price_max=spot_price_max, batch=batch))
 
-    def stop(self, devices):
-        """Power-Off one or more running devices.
+    def retry_delete(self, func, *args, **kwargs):
+        """Call a delete request under the retry policy, a 404 of a repeated attempt counts as success.
+
+        An attempt which failed with a transient error may still have deleted the resource.
         """
-        for device in devices:
-            self.logger.info('Stopping: %s', device.id)
+        attempts = []
+
+        def delete():
+            attempts.append(None)
             try:
-                device.power_off()
-            except packet.baseapi.Error:
-                raise PacketManagerException('Unable to stop instance "{}"'.format(device.id))
+                return func(*args, **kwargs)
+            except packet.baseapi.Error as error:
+                if len(attempts) == 1 or not str(error).startswith('Error 404'):
+                    raise
+                self.logger.info('Resource was already deleted by an earlier attempt.')
+                return None
+
+        return self.retry(delete)
+
+    def power(self, operation, devices, count=None):
+        """Apply a power operation concurrently to devices, optionally only to the newest `count` devices.
+
+        :param operation: One of 'stop', 'reboot' or 'terminate'.
+        :param count: Amount of most recently created devices to operate on, all devices if None or negative.
+        :return: Succeeded, failed and skipped devices.
+        :rtype: :class:`OperationReport`
+        """
+        if operation == 'stop':
+            func, skipped_states = packet.Device.power_off, ('inactive', 'powering_off')
+        elif operation == 'reboot':
+            func, skipped_states = packet.Device.reboot, ('inactive', 'powering_off', 'provisioning')
+        elif operation == 'terminate':
+            func, skipped_states = packet.Device.delete, ('deprovisioning',)
+        else:
+            raise PacketManagerException('Unknown operation "{}"'.format(operation))
+
+        devices = sorted(devices, key=lambda device: device.created_at, reverse=True)
+        selected = devices if count is None or count < 0 else devices[:count]
+        selected_ids = {device.id for device in selected}
+
+        def skip(device):
+            if device.id not in selected_ids:
+                return 'Not among the {} newest devices'.format(count)
+            if device.state in skipped_states:
+                return 'Device is {}'.format(device.state)
+            return None
+
+        def apply(device):
+            self.logger.info('%s: %s', operation.capitalize(), device.id)
+            if operation == 'terminate':
+                return self.retry_delete(func, device)
+            return self.retry(func, device)
+
+        report = BoundedExecutor(self.max_workers).run(apply, devices, skip=skip, operation=operation)
+        self.logger.info(report.summary())
+        return report
+
+    def stop(self, devices, count=None):
+        """Power-Off one or more running devices.
+        """
+        return self.power('stop', devices, count)
 
-    def reboot(self, devices):
+    def reboot(self, devices, count=None):
         """Reboot one or more devices.
         """
-        for device in devices:
-            self.logger.info('Rebooting: %s', device.id)
-            try:
-                device.reboot()
-            except packet.baseapi.Error:
-                raise PacketManagerException('Unable to reboot instance "{}"'.format(device.id))
+        return self.power('reboot', devices, count)
 
-    def terminate(self, devices):
+    def terminate(self, devices, count=None):
         """Terminate one or more running or stopped instances.
         """
-        for device in devices:
-            self.logger.info('Terminating: %s', device.id)
-            try:
-                device.delete()
-            except packet.baseapi.Error:
-                raise PacketManagerException('Unable to terminate instance "{}"'.format(device.id))
+        return self.power('terminate', devices, count)
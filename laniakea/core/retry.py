@@ -0,0 +1,139 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Retry policies for calls against cloud provider APIs."""
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger('laniakea')
+
+
+class ErrorClass:
+    """Classification of errors raised by an API call.
+    """
+    FATAL = 'fatal'
+    TRANSIENT = 'transient'
+    THROTTLED = 'throttled'
+
+
+class TokenBucket:
+    """Thread-safe token bucket which limits the rate of API requests.
+
+    A single bucket is meant to be shared by every caller of the same API so that concurrent
+    callers do not stampede it. When the API signals throttling, the whole bucket is paused.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Tokens added per second.
+        :type rate: float
+        :param capacity: Maximum amount of tokens, defaults to `rate`.
+        :type capacity: float
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """Block until the requested amount of tokens is available and take them.
+
+        :param tokens: Amount of tokens to take.
+        :type tokens: float
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(self.paused_until - now, (tokens - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller of this bucket for the given amount of seconds.
+
+        :param seconds: Duration of the pause.
+        :type seconds: float
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RetryPolicy:
+    """Call functions and retry them with exponential backoff and jitter depending on the raised error.
+
+    The `classify` callback maps an exception to one of the :class:`ErrorClass` values. Fatal errors are
+    raised immediately, transient errors are retried with exponential backoff and throttling errors are
+    retried with a longer backoff which additionally pauses the shared token bucket.
+    """
+
+    def __init__(self, classify, attempts=6, base_delay=0.5, max_delay=30.0, throttle_delay=2.0, bucket=None):
+        """
+        :param classify: Callback which maps an exception to an :class:`ErrorClass` value.
+        :type classify: function
+        :param attempts: Maximum amount of calls.
+        :type attempts: int
+        :param base_delay: Backoff in seconds of the first retry of a transient error.
+        :type base_delay: float
+        :param max_delay: Upper bound of a single backoff in seconds.
+        :type max_delay: float
+        :param throttle_delay: Backoff in seconds of the first retry of a throttling error.
+        :type throttle_delay: float
+        :param bucket: Token bucket shared with other callers of the same API.
+        :type bucket: :class:`TokenBucket`
+        """
+        self.classify = classify
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_delay = throttle_delay
+        self.bucket = bucket
+
+    def backoff(self, attempt, error_class):
+        """Return the delay before the next attempt.
+
+        :param attempt: Number of the failed attempt, starting at 1.
+        :type attempt: int
+        :param error_class: Classification of the error.
+        :type error_class: str
+        :return: Delay in seconds.
+        :rtype: float
+        """
+        base = self.throttle_delay if error_class == ErrorClass.THROTTLED else self.base_delay
+        ceiling = min(self.max_delay, base * 2 ** (attempt - 1))
+        return random.uniform(ceiling / 2, ceiling)
+
+    def __call__(self, func, *args, **kwargs):
+        """Call the given function with the given arguments according to this policy.
+
+        :param func: Function to call
+        :type func: function
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:  # pylint: disable=broad-except
+                error_class = self.classify(error)
+                if error_class == ErrorClass.FATAL or attempt >= self.attempts:
+                    raise
+                delay = self.backoff(attempt, error_class)
+                if error_class == ErrorClass.THROTTLED and self.bucket is not None:
+                    self.bucket.pause(delay)
+                logger.debug('Retrying %s in %.1fs after %s error: %s',
+                             getattr(func, '__name__', func), delay, error_class, error)
+                time.sleep(delay)
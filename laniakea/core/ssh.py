@@ -0,0 +1,157 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""Parallel execution of remote commands via SSH."""
+import os
+import sys
+import getpass
+import logging
+import tempfile
+import threading
+import subprocess
+import collections
+import concurrent.futures
+
+logger = logging.getLogger('laniakea')
+
+
+SSHResult = collections.namedtuple('SSHResult', ['host', 'returncode', 'error'])
+# How to reach the hosts: the OpenSSH client, remote user, private key and client options.
+SSHConnection = collections.namedtuple('SSHConnection', ['binary', 'username', 'identity', 'options'])
+
+
+class SSHExecutor:
+    """Run a command on many hosts with a bounded pool of OpenSSH clients.
+
+    Connections are multiplexed through OpenSSH control masters which stay alive for `persist` seconds,
+    so that subsequent commands against the same hosts do not pay for a new handshake.
+    """
+
+    def __init__(self, username, identity, concurrency=32, timeout=300, connect_timeout=10, persist=60,
+                 options=None, output=None, binary='ssh'):
+        """
+        :param username: Remote user.
+        :type username: str
+        :param identity: Path of the private key.
+        :type identity: str
+        :param concurrency: Maximum amount of hosts handled at the same time.
+        :type concurrency: int
+        :param timeout: Seconds after which the command is killed on a host.
+        :type timeout: int
+        :param connect_timeout: Seconds to wait for a connection to be established.
+        :type connect_timeout: int
+        :param persist: Seconds to keep an idle master connection open.
+        :type persist: int
+        :param options: Additional OpenSSH options as key value pairs.
+        :type options: dict
+        :param output: Stream to which the prefixed output of the hosts is written.
+        :type output: file
+        :param binary: The OpenSSH client.
+        :type binary: str
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.output = output or sys.stdout
+        self.lock = threading.Lock()
+        self.control_dir = os.path.join(tempfile.gettempdir(), 'laniakea-ssh-%s' % getpass.getuser())
+        self.connection = SSHConnection(binary, username, identity, collections.OrderedDict([
+            ('BatchMode', 'yes'),
+            ('StrictHostKeyChecking', 'accept-new'),
+            ('ConnectTimeout', str(connect_timeout)),
+            ('ControlMaster', 'auto'),
+            ('ControlPath', os.path.join(self.control_dir, '%C')),
+            ('ControlPersist', '%ds' % persist),
+        ]))
+        self.connection.options.update(options or {})
+
+    def command(self, host, command):
+        """Build the OpenSSH command-line for running a command on a host.
+
+        :param host: Address of the host.
+        :type host: str
+        :param command: The remote command.
+        :type command: str
+        :return: Arguments for subprocess.
+        :rtype: list
+        """
+        connection = self.connection
+        args = [connection.binary, '-i', connection.identity, '-l', connection.username]
+        for key, value in connection.options.items():
+            args.extend(['-o', '%s=%s' % (key, value)])
+        args.extend([host, command])
+        return args
+
+    def run_on_host(self, host, command):
+        """Run a command on a single host and stream its output prefixed with the host.
+
+        :param host: Address of the host.
+        :type host: str
+        :param command: The remote command.
+        :type command: str
+        :return: The outcome for the host.
+        :rtype: SSHResult
+        """
+        try:
+            proc = subprocess.Popen(self.command(host, command),
+                                    stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    universal_newlines=True,
+                                    errors='replace')
+        except OSError as msg:
+            return SSHResult(host, None, str(msg))
+
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            proc.kill()
+
+        timer = threading.Timer(self.timeout, expire)
+        timer.start()
+        try:
+            for line in proc.stdout:
+                with self.lock:
+                    self.output.write('[%s] %s' % (host, line if line.endswith('\n') else line + '\n'))
+                    self.output.flush()
+            returncode = proc.wait()
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+
+        if expired.is_set():
+            return SSHResult(host, None, 'Timed out after %ds' % self.timeout)
+        return SSHResult(host, returncode, None)
+
+    def run(self, hosts, command):
+        """Run a command on many hosts, at most `concurrency` at a time.
+
+        :param hosts: Addresses of the hosts.
+        :type hosts: list
+        :param command: The remote command.
+        :type command: str
+        :return: The outcome of each host in order of completion.
+        :rtype: list
+        """
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+        results = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self.run_on_host, host, command) for host in hosts]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if result.returncode != 0:
+                    logger.error('%s: %s', result.host, result.error or 'Exit code %d' % result.returncode)
+                results.append(result)
+        return results
+
+    @staticmethod
+    def summarize(results):
+        """Aggregate the outcome of many hosts by exit code.
+
+        :param results: Outcomes of the hosts.
+        :type results: list
+        :return: Amount of hosts by exit code, None for hosts which failed to run the command.
+        :rtype: Counter
+        """
+        return collections.Counter(result.returncode for result in results)
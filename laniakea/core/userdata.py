@@ -34,7 +34,7 @@ class UserData:
         for kv in conditions:  # pylint: disable=invalid-name
             k, v = kv.split('=', 1)  # pylint: disable=invalid-name
             if "," in v:
-                result[k] = v.split(',', 1)
+                result[k] = v.split(',')
             else:
                 result[k] = [v]
         return result
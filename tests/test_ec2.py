@@ -0,0 +1,221 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Tests for EC2.
+"""
+from unittest import mock
+
+import boto.ec2.instance
+import boto.exception
+import boto.resultset
+import pytest
+
+from laniakea.core.cache import JSONCache
+from laniakea.core.retry import RetryPolicy
+from laniakea.core.providers.ec2.manager import EC2Manager, EC2ManagerException, classify_ec2_error
+from laniakea.core.providers.ec2.pool import EC2RegionPool
+
+
+def make_instance(instance_id, state='running'):
+    instance = boto.ec2.instance.Instance()
+    instance.id = instance_id
+    instance._state = boto.ec2.instance.InstanceState(name=state)  # pylint: disable=protected-access
+    return instance
+
+
+def make_request(request_id, state='open', instance_id=None, code='pending-fulfillment'):
+    return mock.Mock(id=request_id, state=state, instance_id=instance_id, status=mock.Mock(code=code))
+
+
+@pytest.fixture
+def ec2():
+    manager = EC2Manager({})
+    manager.ec2 = mock.Mock()
+    manager.retry_policy = RetryPolicy(classify_ec2_error)
+    with mock.patch('time.sleep'):
+        yield manager
+
+
+def test_fulfill_spot_requests_polls_only_open_requests(ec2):
+    ec2.ec2.get_all_spot_instance_requests.side_effect = [
+        [make_request('sir-1', 'active', 'i-1'), make_request('sir-2')],
+        [make_request('sir-2', 'active', 'i-2')],
+    ]
+    ec2.ec2.get_only_instances.side_effect = [[make_instance('i-1')], [make_instance('i-2')]]
+
+    fulfilled = ec2.fulfill_spot_requests(['sir-1', 'sir-2'])
+    assert next(fulfilled).id == 'i-1'
+    assert ec2.ec2.get_all_spot_instance_requests.call_count == 1
+    assert [i.id for i in fulfilled] == ['i-2']
+    assert ec2.ec2.get_all_spot_instance_requests.call_args[1]['request_ids'] == ['sir-2']
+
+
+def test_fulfill_spot_requests_cancels_on_timeout(ec2):
+    ec2.ec2.get_all_spot_instance_requests.return_value = [make_request('sir-1')]
+    with mock.patch('time.monotonic', side_effect=[0, 0, 10]):
+        assert not list(ec2.fulfill_spot_requests(['sir-1'], timeout=5))
+    assert ec2.ec2.get_all_spot_instance_requests.call_count == 2
+
+
+def test_wait_for_instances_batches_state_polls(ec2):
+    pending = [make_instance('i-%d' % i, 'pending') for i in range(200)]
+    ec2.ec2.get_all_reservations.side_effect = [
+        [mock.Mock(instances=[make_instance('i-%d' % i) for i in range(100)] + pending[100:])],
+        [mock.Mock(instances=[make_instance('i-%d' % i) for i in range(100, 200)])],
+    ]
+
+    ready = list(ec2.wait_for_instances(pending))
+    assert len(ready) == 200
+    assert ec2.ec2.get_all_reservations.call_count == 2
+    assert len(ec2.ec2.get_all_reservations.call_args[1]['instance_ids']) == 100
+
+
+def test_wait_for_instances_gives_up_after_deadline(ec2):
+    ec2.ec2.get_all_reservations.return_value = [mock.Mock(instances=[make_instance('i-1', 'pending')])]
+    with mock.patch('time.monotonic', side_effect=[0, 0, 10]):
+        ready = list(ec2.wait_for_instances([make_instance('i-1', 'pending')], timeout=5))
+    assert not ready
+    assert ec2.ec2.get_all_reservations.call_count == 1
+
+
+def test_wait_for_instances_drops_terminated_instances(ec2):
+    ec2.ec2.get_all_reservations.return_value = [mock.Mock(instances=[make_instance('i-1', 'terminated'),
+                                                                      make_instance('i-2')])]
+    pending = [make_instance('i-1', 'pending'), make_instance('i-2', 'pending')]
+    assert [i.id for i in ec2.wait_for_instances(pending)] == ['i-2']
+    assert ec2.ec2.get_all_reservations.call_count == 1
+
+
+def test_create_tags_in_chunks(ec2):
+    ec2.create_tags(['i-%d' % i for i in range(1200)], {'Name': 'fuzzer'})
+    assert [len(c[0][0]) for c in ec2.ec2.create_tags.call_args_list] == [500, 500, 200]
+
+
+def test_iter_instances_follows_next_token(ec2):
+    first = boto.resultset.ResultSet()
+    first.extend([mock.Mock(instances=[make_instance('i-1')])])
+    first.next_token = 'token'
+    second = boto.resultset.ResultSet()
+    second.extend([mock.Mock(instances=[make_instance('i-2')])])
+    ec2.ec2.get_all_reservations.side_effect = [first, second]
+
+    records = list(ec2.iter_instances(filters={'tag:Name': 'fuzzer'}, projection=True))
+    assert [(r.id, r.state) for r in records] == [('i-1', 'running'), ('i-2', 'running')]
+    assert ec2.ec2.get_all_reservations.call_args[1]['next_token'] == 'token'
+
+
+def test_region_pool_fans_out_and_groups_by_region():
+    pool = EC2RegionPool({})
+    for region in ('us-east-1', 'us-west-2'):
+        manager = EC2Manager({})
+        manager.ec2 = mock.Mock()
+        manager.ec2.region.name = region
+        instance = make_instance('i-' + region)
+        instance.region = manager.ec2.region
+        manager.ec2.get_all_reservations.return_value = [mock.Mock(instances=[instance])]
+        pool.managers[region] = manager
+
+    records = list(pool.iter_instances(projection=True))
+    assert sorted((r.id, r.region) for r in records) == [('i-us-east-1', 'us-east-1'), ('i-us-west-2', 'us-west-2')]
+
+    pool.terminate(records)
+    for region, manager in pool.managers.items():
+        manager.ec2.terminate_instances.assert_called_once_with(['i-' + region])
+
+    with pytest.raises(EC2ManagerException):
+        pool.create_on_demand('default', {})
+    assert not any(manager.ec2.run_instances.called for manager in pool.managers.values())
+
+
+def test_region_pool_keeps_results_of_healthy_regions():
+    pool = EC2RegionPool({})
+    for region in ('us-east-1', 'us-west-2'):
+        manager = EC2Manager({})
+        manager.ec2 = mock.Mock()
+        manager.retry_policy = RetryPolicy(classify_ec2_error, attempts=1)
+        if region == 'us-east-1':
+            manager.ec2.get_all_reservations.side_effect = boto.exception.EC2ResponseError(403, 'Forbidden')
+            manager.ec2.terminate_instances.side_effect = boto.exception.EC2ResponseError(403, 'Forbidden')
+        else:
+            manager.ec2.get_all_reservations.return_value = [mock.Mock(instances=[make_instance('i-1')])]
+        pool.managers[region] = manager
+
+    assert [i.id for i in pool.find()] == ['i-1']
+    records = [mock.Mock(id='i-%s' % region, region=region, launch_time=region) for region in pool.managers]
+    report = pool.terminate(records)
+    assert report.succeeded == ['us-west-2']
+    assert report.failed_items == ['us-east-1']
+
+
+def test_resolve_image_names_batches_and_caches(ec2, tmp_path):
+    ec2.ec2.region.name = 'us-west-2'
+    images = {}
+    for image_id, name in [('ami-1', 'fuzzer'), ('ami-other', 'unrelated'), ('ami-2', 'base')]:
+        images[name] = mock.Mock(id=image_id)
+        images[name].name = name
+    ec2.ec2.get_all_images.side_effect = [[images['fuzzer'], images['unrelated']], [images['base']]]
+    ec2.image_cache = JSONCache(str(tmp_path / 'images.json'))
+
+    assert ec2.resolve_image_names(['fuzzer', 'base']) == {'fuzzer': 'ami-1', 'base': 'ami-2'}
+    assert ec2.ec2.get_all_images.call_count == 2
+    assert ec2.ec2.get_all_images.call_args[1]['filters'] == {'name': ['base']}
+
+    other = EC2Manager({'default': {'image_name': 'base'}}, JSONCache(str(tmp_path / 'images.json')))
+    other.ec2 = mock.Mock()
+    other.ec2.region.name = 'us-west-2'
+    with mock.patch('boto.ec2.connect_to_region', return_value=other.ec2):
+        other.connect('us-west-2')
+    assert not other.ec2.get_all_images.called
+    params = other._launch_params('default', 'instance_store', 'default', 'gp2', False)  # pylint: disable=W0212
+    assert params == {'image_id': 'ami-2'}
+    assert other.images['default'] == {'image_name': 'base'}
+    assert not other.ec2.get_all_images.called
+
+
+def test_connect_does_not_resolve_image_names(ec2):
+    ec2.images = {'default': {'image_name': 'only-in-us-west-2'}}
+    with mock.patch('boto.ec2.connect_to_region', return_value=ec2.ec2):
+        ec2.connect('eu-central-1')
+    assert not ec2.ec2.get_all_images.called
+
+
+def test_spot_planner_spreads_across_cheapest_calm_zones(ec2):
+    history = [
+        ('us-west-2a', '2019-01-01T00:00:00', 0.04), ('us-west-2a', '2019-01-01T01:00:00', 0.04),
+        ('us-west-2b', '2019-01-01T00:00:00', 0.01), ('us-west-2b', '2019-01-01T01:00:00', 0.09),
+        ('us-west-2c', '2019-01-01T00:00:00', 0.03), ('us-west-2c', '2019-01-01T01:00:00', 0.03),
+        ('us-west-2d', '2019-01-01T00:00:00', 0.02), ('us-west-2d', '2019-01-01T01:00:00', 0.20),
+    ]
+    ec2.ec2.get_spot_price_history.return_value = [
+        mock.Mock(availability_zone=zone, timestamp=timestamp, price=price) for zone, timestamp, price in history]
+
+    plan = ec2.spot_planner.plan('c5.2xlarge', 10, 0.1, max_zones=3)
+    assert list(plan.items()) == [('us-west-2c', 4), ('us-west-2a', 3), ('us-west-2b', 3)]
+    ec2.spot_planner.plan('c5.2xlarge', 10, 0.1)
+    assert ec2.ec2.get_spot_price_history.call_count == 1
+
+
+def test_create_spot_capacity_falls_back_to_next_type(ec2):
+    ec2.images = {'default': {'image_id': 'ami-1', 'instance_type': 'c5.4xlarge', 'instance_types': [
+        {'instance_type': 'c5.4xlarge', 'weight': 16},
+        {'instance_type': 'c5.2xlarge', 'weight': 8},
+    ]}}
+    ec2.ec2.request_spot_instances.side_effect = [[mock.Mock(id='sir-big')],
+                                                  [mock.Mock(id='sir-1'), mock.Mock(id='sir-2')]]
+    ec2.ec2.get_all_spot_instance_requests.side_effect = [
+        [make_request('sir-big', code='capacity-not-available')],
+        [make_request('sir-big', code='capacity-not-available')],
+        [make_request('sir-1', 'active', 'i-1'), make_request('sir-2', 'active', 'i-2')],
+    ]
+    ec2.ec2.get_only_instances.return_value = [make_instance('i-1'), make_instance('i-2')]
+
+    with mock.patch('time.monotonic', side_effect=[0, 0, 10, 0, 0, 0]):
+        instances = ec2.create_spot_capacity(0.1, 10, fallback_timeout=5, root_device_type='instance_store')
+
+    assert [i.id for i in instances] == ['i-1', 'i-2']
+    assert [c[1]['instance_type'] for c in ec2.ec2.request_spot_instances.call_args_list] == ['c5.4xlarge',
+                                                                                              'c5.2xlarge']
+    assert [c[1]['count'] for c in ec2.ec2.request_spot_instances.call_args_list] == [1, 2]
+    assert 'instance_types' not in ec2.ec2.request_spot_instances.call_args[1]
@@ -0,0 +1,46 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Tests for the bounded executor.
+"""
+import threading
+import time
+
+from laniakea.core.executor import BoundedExecutor
+
+
+def test_executor_bounds_concurrency():
+    lock = threading.Lock()
+    barrier = threading.Barrier(3, timeout=5)
+    running = [0, 0]
+
+    def work(item):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        if item < 3:
+            # The first three items only finish once all of them run at the same time.
+            barrier.wait()
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return item * 2
+
+    report = BoundedExecutor(max_workers=3).run(work, range(20))
+    assert running[1] == 3
+    assert sorted(report.results) == list(range(0, 40, 2))
+
+
+def test_executor_collects_failures_and_skips():
+    def work(item):
+        if item == 3:
+            raise ValueError('broken')
+        return item != 4
+
+    report = BoundedExecutor().run(work, range(6), skip=lambda item: 'even' if item == 0 else None, operation='work')
+    assert sorted(report.succeeded) == [1, 2, 5]
+    assert sorted(report.failed_items) == [3, 4]
+    assert report.skipped == [(0, 'even')]
+    assert report.summary() == 'work: 3 succeeded, 2 failed, 1 skipped'
@@ -0,0 +1,285 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Tests for Google Compute Engine.
+"""
+from unittest import mock
+
+import pytest
+from libcloud.common.google import GoogleBaseError, ResourceNotFoundError
+from libcloud.compute.drivers.gce import GCENodeDriver, GCEZone
+
+from laniakea.core.executor import BoundedExecutor
+from laniakea.core.retry import RetryPolicy
+from laniakea.core.providers.gce.filters import Filter
+from laniakea.core.providers.gce.manager import (ComputeEngineManager, ComputeEngineManagerException,
+                                                 classify_gce_create_error, classify_gce_error)
+from laniakea.core.providers.gce.operations import Operation
+from laniakea.core.providers.gce.reconciler import PoolReconciler
+
+ZONE_URL = 'https://www.googleapis.com/compute/v1/projects/fuzzing/zones/%s'
+
+
+def make_instance(name, zone='us-east1-b', status='RUNNING', labels=None, tags=None, preemptible=True):
+    return {
+        'id': name,
+        'name': name,
+        'zone': ZONE_URL % zone,
+        'status': status,
+        'machineType': ZONE_URL % zone + '/machineTypes/n1-standard-8',
+        'labels': labels or {},
+        'tags': {'fingerprint': 'x', 'items': tags or []},
+        'scheduling': {'preemptible': preemptible},
+        'disks': [{'boot': True, 'type': 'PERSISTENT', 'source': ZONE_URL % zone + '/disks/' + name}],
+        'networkInterfaces': [{'networkIP': '10.0.0.1', 'accessConfigs': [{'natIP': '1.2.3.4'}]}],
+    }
+
+
+def make_response(*pages):
+    responses = []
+    for idx, page in enumerate(pages):
+        items = {}
+        for instance in page:
+            zone = 'zones/' + instance['zone'].rsplit('/', 1)[1]
+            items.setdefault(zone, {'instances': []})['instances'].append(instance)
+        obj = {'items': items}
+        if idx + 1 < len(pages):
+            obj['nextPageToken'] = 'page-%d' % (idx + 1)
+        responses.append(mock.Mock(object=obj))
+    return responses
+
+
+@pytest.fixture
+def gce():
+    manager = ComputeEngineManager('user', 'key', 'fuzzing')
+    manager.gce = GCENodeDriver.__new__(GCENodeDriver)
+    manager.gce.zone_dict = {zone: GCEZone(zone, zone, 'UP', None, None, manager.gce)
+                             for zone in ('us-east1-b', 'us-east1-c')}
+    manager.gce.connection = mock.Mock()
+    manager.retry = RetryPolicy(classify_gce_error)
+    manager.create_retry = RetryPolicy(classify_gce_create_error)
+    manager.executor = BoundedExecutor(4, retry=manager.retry)
+    return manager
+
+
+def test_filter_sends_expressions_and_follows_pages(gce):
+    gce.gce.connection.request.side_effect = make_response(
+        [make_instance('a', labels={'pool': 'x'}, tags=['fuzz'])],
+        [make_instance('b', zone='us-east1-c', labels={'pool': 'x'})])
+
+    query = gce.filter().state(['running']).name(['a', 'b']).labels({'pool': 'x'}).tags(['fuzz'])
+    assert not gce.gce.connection.request.called
+    assert [node.name for node in query.nodes] == ['a']
+
+    calls = gce.gce.connection.request.call_args_list
+    assert len(calls) == 2
+    assert calls[0][1]['params']['filter'] == '(status eq "RUNNING") (name eq "a|b") (labels.pool eq "x")'
+    assert calls[1][1]['params']['pageToken'] == 'page-1'
+
+
+def test_filter_keeps_unexpressible_filters_client_side(gce):
+    gce.gce.connection.request.side_effect = make_response(
+        [make_instance('a', labels={'pool': 'x'}), make_instance('b', labels={'owner': 'y'}),
+         make_instance('c', labels={'pool': 'z'})])
+
+    nodes = gce.filter().labels({'pool': 'x', 'owner': 'y'}).nodes
+    assert [node.name for node in nodes] == ['a', 'b']
+    assert 'filter' not in gce.gce.connection.request.call_args[1]['params']
+
+
+def test_filter_of_node_list_is_eager():
+    nodes = [mock.Mock(state='running', extra={'labels': {}, 'tags': []}), mock.Mock(state='stopped')]
+    nodes[0].name = 'a'
+    nodes[1].name = 'b'
+    assert Filter(nodes).state(['Running']).name(['a']).nodes == nodes[:1]
+
+
+def test_filter_intersects_indexes_and_keeps_order():
+    nodes = []
+    for i in range(1000):
+        node = mock.Mock(state='running' if i % 2 else 'stopped',
+                         extra={'labels': {'pool': 'a' if i % 3 else 'b'}, 'tags': ['fuzz'] if i % 5 else []})
+        node.name = 'node-%d' % i
+        nodes.append(node)
+    names = ['node-%d' % i for i in range(0, 1000, 7)]
+    evaluated = []
+
+    def expression(node):
+        evaluated.append(node)
+        return node.name != 'node-7'
+
+    result = Filter(nodes).name(names).state(['running']).labels({'pool': 'a'}).tags(['fuzz']).expr(expression)
+    expected = [n for i, n in enumerate(nodes) if i % 7 == 0 and i % 2 and i % 3 and i % 5 and i != 7]
+    assert result.nodes == expected
+    assert len(evaluated) == len(expected) + 1
+    assert result.has_labels(['owner']).nodes == []
+
+
+def test_lifecycle_reports_every_node(gce):
+    nodes = [mock.Mock(state='running' if i else 'stopped') for i in range(50)]
+    for i, node in enumerate(nodes):
+        node.name = 'node-%d' % i
+    gce.gce.ex_stop_node = mock.Mock(side_effect=lambda node: node.name != 'node-7')
+
+    report = gce.lifecycle('stop', nodes)
+    assert gce.gce.ex_stop_node.call_count == 49
+    assert report.failed_items == [nodes[7]]
+    assert [node for node, _ in report.skipped] == [nodes[0]]
+    assert sorted(report.succeeded, key=nodes.index) == nodes[1:7] + nodes[8:]
+    assert not report
+
+
+def test_terminate_treats_missing_node_on_retry_as_destroyed(gce):
+    nodes = [mock.Mock() for _ in range(2)]
+    for i, node in enumerate(nodes):
+        node.name = 'node-%d' % i
+    gce.gce.destroy_node = mock.Mock(side_effect=[
+        GoogleBaseError('Backend error', 503, 'backendError'), ResourceNotFoundError('missing', 404, 'notFound'),
+        ResourceNotFoundError('missing', 404, 'notFound')])
+    gce.executor = BoundedExecutor(1, retry=gce.retry)
+
+    with mock.patch('time.sleep'):
+        assert gce.terminate_with_threads(nodes) == [nodes[1]]
+    assert gce.gce.destroy_node.call_count == 3
+
+
+def test_submit_destroy_and_track_operations_in_batches(gce):
+    nodes = [mock.Mock(extra={'zone': gce.gce.zone_dict['us-east1-b']}) for _ in range(3)]
+    for i, node in enumerate(nodes):
+        node.name = 'node-%d' % i
+
+    def request(path, method='GET', params=None, data=None):  # pylint: disable=unused-argument
+        if method == 'DELETE':
+            name = path.rsplit('/', 1)[1]
+            if name == 'node-2':
+                raise GoogleBaseError('Not allowed', 403, 'forbidden')
+            return mock.Mock(object={'name': 'op-' + name, 'status': 'PENDING'})
+        responses.append(params)
+        status = 'DONE' if len(responses) > 1 else 'RUNNING'
+        return mock.Mock(object={'items': {'zones/us-east1-b': {'operations': [
+            {'name': 'op-node-0', 'status': 'DONE'},
+            {'name': 'op-node-1', 'status': status, 'error': {'errors': [{'code': 'QUOTA', 'message': 'No'}]}},
+        ]}}})
+
+    responses = []
+    gce.gce.connection.request.side_effect = request
+    operations = gce.submit_destroy(nodes)
+    assert sorted(operation.target for operation in operations) == ['node-0', 'node-1', 'node-2']
+    assert not gce.gce.connection.request.call_args_list[-1][1].get('params')
+
+    with mock.patch('time.sleep'):
+        report = gce.track(operations).wait()
+    assert [operation.target for operation in report.succeeded] == ['node-0']
+    assert sorted((operation.target, operation.code) for operation in report.failed_items) == [
+        ('node-1', 'QUOTA'), ('node-2', 'forbidden')]
+    assert len(responses) == 2
+    assert sorted(responses[0]['filter'][10:-2].split('|')) == ['op\\-node\\-0', 'op\\-node\\-1']
+    assert responses[1]['filter'] == '(name eq "op\\-node\\-1")'
+
+
+def test_destroy_requests_failed_nodes_again(gce):
+    nodes = [mock.Mock(extra={'zone': gce.gce.zone_dict['us-east1-b']}) for _ in range(2)]
+    for i, node in enumerate(nodes):
+        node.name = 'node-%d' % i
+
+    def request(path, method='GET', params=None, data=None):  # pylint: disable=unused-argument
+        name = path.rsplit('/', 1)[1]
+        deleted.append(name)
+        if name == 'node-1' and deleted.count(name) == 1:
+            raise ValueError('Connection reset')
+        return mock.Mock(object={'name': 'op-%s-%d' % (name, len(deleted)), 'status': 'DONE'})
+
+    deleted = []
+    gce.gce.connection.request.side_effect = request
+    with mock.patch('time.sleep'):
+        report = gce.destroy(nodes)
+    assert sorted(operation.target for operation in report.succeeded) == ['node-0', 'node-1']
+    assert sorted(deleted) == ['node-0', 'node-1', 'node-1']
+
+
+def test_submit_create_does_not_repeat_failed_inserts(gce):
+    gce.gce = mock.Mock()
+    gce.gce._create_node_req.return_value = ('/zones/us-east1-b/instances', {})  # pylint: disable=protected-access
+    gce.gce.connection.request.side_effect = [
+        GoogleBaseError('Rate limit exceeded', 403, 'rateLimitExceeded'),
+        GoogleBaseError('Backend error', 503, 'backendError'),
+    ]
+    with mock.patch('time.sleep'):
+        operations = gce.submit_create('n1-standard-8', 1, {'ex_disks_gce_struct': [{}]}, name='node')
+    assert gce.gce.connection.request.call_count == 2
+    assert [operation.code for operation in operations] == ['backendError']
+
+
+def test_create_spread_redirects_exhausted_zones(gce):
+    def submit_create(size, number, meta, name=None, image=None):  # pylint: disable=unused-argument
+        zone = meta['location']
+        requests.append((zone, number))
+        error = {'errors': [{'code': 'ZONE_RESOURCE_POOL_EXHAUSTED'}]} if zone == 'us-east1-c' else None
+        return [Operation('insert', '%s-%d' % (zone, i), zone, {'name': 'op', 'status': 'DONE', 'error': error})
+                for i in range(number)]
+
+    requests = []
+    gce.submit_create = submit_create
+    assert gce.zones_of_region('us-east1') == ['us-east1-b', 'us-east1-c']
+
+    report = gce.create_spread('n1-standard-8', 5, {'location': 'us-east1-b'}, ['us-east1-b', 'us-east1-c'])
+    assert sorted(requests) == [('us-east1-b', 2), ('us-east1-b', 3), ('us-east1-c', 2)]
+    assert len(report.succeeded) == 5
+    assert not report.failed
+
+
+def test_create_group_resizes_existing_group(gce):
+    meta = gce.build_container_vm('declaration', gce.build_bootdisk('cos'), zone='us-east1-b')
+    gce.gce = mock.Mock()
+    gce.gce.ex_get_instancetemplate.side_effect = ResourceNotFoundError('missing', 404, 'notFound')
+    gce.gce.ex_get_instancegroupmanager.side_effect = ResourceNotFoundError('missing', 404, 'notFound')
+
+    gce.create_group('pool', 'n1-standard-8', 100, meta)
+    template = gce.gce.ex_create_instancetemplate.call_args
+    assert template[0][0].startswith('pool-')
+    assert template[1]['disks_gce_struct'] == meta['ex_disks_gce_struct']
+    gce.gce.ex_create_instancegroupmanager.assert_called_once_with(
+        'pool', 'us-east1-b', gce.gce.ex_create_instancetemplate.return_value, 100, base_instance_name='pool')
+
+    group = mock.Mock(size=100)
+    group.template.name = template[0][0]
+    gce.gce.ex_get_instancetemplate.side_effect = None
+    gce.gce.ex_get_instancetemplate.return_value.name = template[0][0]
+    gce.gce.ex_get_instancegroupmanager.side_effect = None
+    gce.gce.ex_get_instancegroupmanager.return_value = group
+    gce.create_group('pool', 'n1-standard-8', 1000, meta)
+    gce.gce.ex_instancegroupmanager_resize.assert_called_once_with(group, 1000)
+    assert not gce.gce.ex_instancegroupmanager_set_instancetemplate.called
+
+
+def test_reconciler_replaces_preempted_nodes(gce):
+    gce.gce.connection.request.side_effect = make_response(
+        [make_instance('a', labels={'laniakea-pool': 'fuzz'}),
+         make_instance('b', status='TERMINATED', labels={'laniakea-pool': 'fuzz'})])
+    gce.submit_destroy = mock.Mock(side_effect=lambda nodes: [
+        Operation('delete', node.name, 'us-east1-b', {'name': 'op-' + node.name, 'status': 'RUNNING'})
+        for node in nodes])
+    gce.submit_create = mock.Mock(side_effect=lambda size, number, meta, image=None: [
+        Operation('insert', 'new-%d' % i, meta['location'],
+                  {'name': 'op-%s-%d' % (meta['location'], i), 'status': 'PENDING'})
+        for i in range(number)])
+
+    reconciler = PoolReconciler(gce, 'n1-standard-8', 4, {'ex_labels': {'owner': 'x'}}, {'laniakea-pool': 'fuzz'},
+                                ['us-east1-b', 'us-east1-c'])
+    status = reconciler.tick()
+    assert gce.gce.connection.request.call_args[1]['params']['filter'] == '(labels.laniakea-pool eq "fuzz")'
+    assert [node.name for node in gce.submit_destroy.call_args[0][0]] == ['b']
+    assert [c[0][1] for c in gce.submit_create.call_args_list] == [2, 1]
+    assert gce.submit_create.call_args[0][2]['ex_labels'] == {'owner': 'x', 'laniakea-pool': 'fuzz'}
+    assert (status.alive, status.dead, status.creating, status.deleting) == (1, 1, 3, 1)
+
+
+def test_reconciler_keeps_running_after_failed_listing():
+    manager = mock.Mock()
+    manager.filter.side_effect = ComputeEngineManagerException('Unable to list nodes')
+    reconciler = PoolReconciler(manager, 'n1-standard-8', 4, {}, {'laniakea-pool': 'fuzz'}, ['us-east1-b'])
+    with mock.patch('time.sleep'):
+        reconciler.run(ticks=2)
+    assert manager.filter.call_count == 2
@@ -7,9 +7,16 @@ Tests for Packet.
 """
 import os
 import json
+import threading
+from unittest import mock
+
+import packet
 import pytest
 
-from laniakea.core.providers.packet import PacketManager
+from laniakea.core.cache import JSONCache
+from laniakea.core.retry import RetryPolicy
+from laniakea.core.providers.packet import PacketManager, PacketManagerException
+from laniakea.core.providers.packet.manager import SpotBidPlanner, classify_packet_create_error, classify_packet_error
 
 # @pytest.fixture
 # def packet():
@@ -22,3 +29,238 @@ from laniakea.core.providers.packet import PacketManager
 #    for plan in packet.list_projects():
 #        assert hasattr(plan, 'name')
 #        assert hasattr(plan, 'id')
+
+
+@pytest.fixture
+def manager():
+    cluster = PacketManager({'auth_token': 'token', 'projects': {'fuzzing': 'project'}})
+    cluster.manager = mock.Mock()
+    cluster.api = cluster.manager.call_api
+    cluster.retry = RetryPolicy(classify_packet_error)
+    cluster.create_retry = RetryPolicy(classify_packet_create_error)
+    with mock.patch('time.sleep'):
+        yield cluster
+
+
+def test_create_demand_keeps_going_after_failures(manager):
+    def create_device(hostname, **kwargs):  # pylint: disable=unused-argument
+        if hostname == 'fuzz-3':
+            raise packet.baseapi.Error('Error 422: no capacity')
+        return mock.Mock(hostname=hostname)
+    manager.manager.create_device.side_effect = create_device
+
+    devices = manager.create_demand('project', 'nrt1', 'baremetal_0', 'ubuntu_18_04', hostname='fuzz', count=5)
+    assert sorted(device.hostname for device in devices) == ['fuzz-1', 'fuzz-2', 'fuzz-4', 'fuzz-5']
+    assert manager.manager.create_device.call_count == 5
+
+
+def test_create_spot_with_batch_endpoint(manager):
+    manager.manager.call_api.side_effect = [
+        {'batches': [{'id': 'b1'}]},
+        {'id': 'b1', 'state': 'processing'},
+        {'id': 'b1', 'state': 'completed', 'error_messages': ['capacity'],
+         'devices': [{'id': 'd1', 'hostname': 'fuzz-1'}]},
+    ]
+    with mock.patch('packet.Device', side_effect=lambda data, _: mock.Mock(**data)):
+        report = manager.provision('project', 'nrt1', 'baremetal_0', 'ubuntu_18_04', count=2, hostname='fuzz',
+                                   spot_price_max=0.1, batch=True)
+    assert report.succeeded == ['fuzz-1']
+    assert report.failed == [('fuzz-2', 'capacity')]
+    body = manager.manager.call_api.call_args_list[0][1]['params']['batches'][0]
+    assert body['hostnames'] == ['fuzz-1', 'fuzz-2'] and body['spot_instance'] and body['quantity'] == 2
+
+
+def test_iter_devices_follows_pages(manager):
+    def page(number, hostnames, last_page=3):
+        return {'devices': [{'hostname': hostname, 'state': 'active'} for hostname in hostnames],
+                'meta': {'current_page': number, 'last_page': last_page}}
+    manager.manager.call_api.side_effect = [page(1, ['a', 'b']), page(2, ['c']), page(3, ['d', 'e'])]
+
+    with mock.patch('packet.Device', side_effect=lambda data, _: data['hostname']):
+        assert list(manager.iter_devices('project')) == ['a', 'b', 'c', 'd', 'e']
+    assert [c[1]['params']['page'] for c in manager.manager.call_api.call_args_list] == [1, 2, 3]
+
+
+def test_filter_returns_each_device_once():
+    devices = [
+        {'id': 1, 'state': 'active', 'tags': ['fuzz', 'asan'], 'plan': {'slug': 'baremetal_0'}, 'spot_instance': True},
+        {'id': 2, 'state': 'active', 'tags': [], 'plan': {'slug': 'baremetal_1'}, 'spot_instance': False},
+        {'id': 3, 'state': 'inactive', 'tags': ['fuzz'], 'plan': {'slug': 'baremetal_0'}, 'spot_instance': True},
+    ]
+    criterias = {'state': ['active', 'inactive'], 'tags': ['fuzz', 'asan'], 'id': ['1']}
+    assert [d['id'] for d in PacketManager.filter(criterias, devices)] == [1, 2, 3]
+    assert [d['id'] for d in PacketManager.filter(criterias, devices, mode='all')] == [1]
+    assert [d['id'] for d in PacketManager.filter({'plan.slug': ['baremetal_0'], 'spot_instance': ['True']},
+                                                  devices, mode='all')] == [1, 3]
+
+
+def test_terminate_newest_devices_despite_failures(manager):
+    devices = []
+    for i in range(5):
+        device = mock.Mock(id='d%d' % i, created_at='2019-01-0%dT00:00:00Z' % (i + 1),
+                           state='deprovisioning' if i == 3 else 'active')
+        devices.append(device)
+    deleted = []
+
+    def delete(device):
+        if device.id == 'd4':
+            raise packet.baseapi.Error('Error 403: forbidden')
+        if device.id == 'd2' and device.id in deleted:
+            raise packet.baseapi.Error('Error 404: not found')
+        deleted.append(device.id)
+        if device.id == 'd2':
+            raise packet.baseapi.Error('Error 503: unavailable')
+
+    with mock.patch.object(packet.Device, 'delete', delete):
+        report = manager.terminate(devices, count=4)
+    assert sorted(deleted) == ['d1', 'd2']
+    assert report.failed_items == [devices[4]]
+    assert sorted(device.id for device in report.succeeded) == ['d1', 'd2']
+    assert sorted(device.id for device, _ in report.skipped) == ['d0', 'd3']
+
+
+def test_catalog_is_cached_and_validates_offline(manager, tmp_path):
+    manager.catalog = JSONCache(str(tmp_path / 'catalog.json'))
+    manager.manager.call_api.side_effect = lambda path, **kwargs: {
+        'facilities': {'facilities': [{'id': 1, 'code': 'nrt1', 'name': 'Tokyo', 'features': [], 'address': {}}]},
+        'plans': {'plans': [{'id': 2, 'name': 'c1', 'slug': 'baremetal_1', 'line': 'baremetal', 'pricing': {},
+                             'specs': {}, 'description': ''}]},
+        'operating-systems': {'operating_systems': [{'slug': 'ubuntu_18_04', 'name': 'Ubuntu', 'distro': 'ubuntu',
+                                                     'version': '18.04', 'provisionable_on': ['baremetal_1']}]},
+    }[path]
+    manager.validate_create('nrt1', 'baremetal_1', 'ubuntu_18_04')
+    manager.validate_create('any', 'baremetal_1', 'ubuntu_18_04')
+    assert manager.manager.call_api.call_count == 3
+
+    manager.catalog = JSONCache(str(tmp_path / 'catalog.json'))
+    with pytest.raises(PacketManagerException, match='Unknown plan "baremetal_0"'):
+        manager.validate_create('nrt1', 'baremetal_0', 'ubuntu_18_04')
+    assert [plan.slug for plan in manager.list_plans()] == ['baremetal_1']
+    assert manager.manager.call_api.call_count == 3
+
+
+def test_spot_planner_picks_cheapest_cores_with_capacity(manager):
+    manager.list_spot_prices = mock.Mock(return_value={'spot_market_prices': {
+        'nrt1': {'baremetal_0': {'price': 0.02}, 'baremetal_2': {'price': 0.30}},
+        'ams1': {'baremetal_2': {'price': 0.12}, 'unknown_plan': {'price': 0.01}},
+        'sjc1': {'baremetal_3': {'price': 0.16}},
+    }})
+    manager.validate_capacity = mock.Mock(side_effect=lambda servers: all(s[0] != 'ams1' for s in servers))
+    planner = SpotBidPlanner(manager, bid_factor=1.0)
+
+    assert [c[:2] for c in planner.candidates()] == [('nrt1', 'baremetal_0'), ('ams1', 'baremetal_2'),
+                                                     ('sjc1', 'baremetal_3'), ('nrt1', 'baremetal_2')]
+    allocations = planner.plan(48, budget=1.0, max_per_option=6)
+    assert [(a.facility, a.plan, a.count) for a in allocations] == [('nrt1', 'baremetal_0', 6),
+                                                                    ('sjc1', 'baremetal_3', 2)]
+    assert manager.validate_capacity.call_count == 4
+
+
+def test_wait_for_devices_polls_project_once_per_tick(manager):
+    def page(states):
+        return {'devices': [{'id': 'd%d' % i, 'hostname': 'fuzz-%d' % i, 'state': state}
+                            for i, state in enumerate(states) if state],
+                'meta': {'current_page': 1, 'last_page': 1}}
+    manager.manager.call_api.side_effect = [
+        page(['active', 'provisioning', 'queued', 'queued', 'queued']),
+        page(['active', 'active', 'failed', 'provisioning', None]),
+        page(['active', 'active', None, 'provisioning', None]),
+        page(['active', 'active', None, 'provisioning', None]),
+    ]
+    devices = [mock.Mock(id='d%d' % i, state='queued') for i in range(5)]
+
+    with mock.patch('packet.Device', side_effect=lambda data, _: mock.Mock(**data)):
+        with mock.patch('time.monotonic', side_effect=[0, 0, 0, 0, 10]):
+            waiter = manager.wait_for_devices('project', devices, timeout=5)
+            assert [device.id for device in waiter] == ['d0', 'd1']
+    assert manager.manager.call_api.call_count == 4
+    assert [device.id for device, _ in waiter.report.failed] == ['d2', 'd4']
+    assert [(device.id, reason) for device, reason in waiter.report.skipped] == [
+        ('d3', 'Not active after 5s, last state provisioning')]
+
+
+def test_provision_volumes_attaches_while_devices_boot(manager):
+    devices = [mock.Mock(id='d%d' % i, hostname='fuzz-%d' % i, state='queued', facility={'code': 'nrt1'})
+               for i in range(6)]
+    volumes = {}
+
+    def create_volume(project_id, description, plan, size, facility):  # pylint: disable=unused-argument
+        if description == 'scratch-fuzz-1':
+            raise packet.baseapi.Error('Error 422: no capacity')
+        volumes[description] = mock.Mock(id='v-' + description, state='queued')
+        return volumes[description]
+
+    def call_api(path, type='GET', params=None):  # pylint: disable=redefined-builtin
+        if path.startswith('storage/'):
+            if type == 'POST':
+                if params['device_id'] == 'd4':
+                    raise packet.baseapi.Error('Error 422: device is busy')
+                attached.append((path, params['device_id']))
+                return {}
+            return {'state': 'failed' if path == 'storage/v-scratch-fuzz-5' else 'active'}
+        return {'devices': [{'id': 'd%d' % i, 'hostname': 'fuzz-%d' % i, 'state': state}
+                            for i, state in enumerate(['active', 'active', 'active', 'failed', 'active', 'active'])],
+                'meta': {'current_page': 1, 'last_page': 1}}
+
+    attached = []
+    manager.manager.create_volume.side_effect = create_volume
+    manager.manager.call_api.side_effect = call_api
+    with mock.patch('packet.Device', side_effect=lambda data, _: mock.Mock(**data)):
+        report = manager.provision_volumes('project', devices, 'storage_1', 100)
+
+    assert sorted(attached) == [('storage/v-scratch-fuzz-0/attachments', 'd0'),
+                                ('storage/v-scratch-fuzz-2/attachments', 'd2')]
+    assert sorted(device.id for device in report.succeeded) == ['d0', 'd2']
+    assert sorted(device.id for device in report.failed_items) == ['d1', 'd3', 'd4', 'd5']
+    assert [name for name, volume in sorted(volumes.items()) if volume.delete.called] == [
+        'scratch-fuzz-3', 'scratch-fuzz-4', 'scratch-fuzz-5']
+    assert not manager.manager.get_volume.called
+
+
+def test_provision_volumes_reports_every_device_of_a_busy_pool(manager):
+    devices = [mock.Mock(id='d%d' % i, hostname='fuzz-%d' % i, state='queued', facility={'code': 'nrt1'})
+               for i in range(3)]
+    manager.max_workers = 1
+    busy = threading.Event()
+
+    def create_volume(project_id, description, plan, size, facility):  # pylint: disable=unused-argument
+        busy.wait(0.1)
+        return mock.Mock(id='v-' + description, state='active')
+
+    manager.manager.create_volume.side_effect = create_volume
+    manager.list_devices = mock.Mock(return_value=[mock.Mock(id=device.id, state='active') for device in devices])
+
+    report = manager.provision_volumes('project', devices, 'storage_1', 100)
+    assert sorted(device.id for device in report.succeeded) == ['d0', 'd1', 'd2']
+    assert not report.failed
+
+
+def test_provision_volumes_deletes_volumes_when_waiting_fails(manager):
+    devices = [mock.Mock(id='d%d' % i, hostname='fuzz-%d' % i, state='queued', facility={'code': 'nrt1'})
+               for i in range(2)]
+    volumes = []
+    created = threading.Semaphore(0)
+    manager.manager.create_volume.side_effect = lambda *args: volumes.append(mock.Mock(state='active')) or \
+        created.release() or volumes[-1]
+
+    def list_devices(project_id):  # pylint: disable=unused-argument
+        for _ in devices:
+            created.acquire(timeout=5)
+        raise packet.baseapi.Error('Error 403: forbidden')
+
+    manager.list_devices = list_devices
+    with pytest.raises(PacketManagerException):
+        manager.provision_volumes('project', devices, 'storage_1', 100)
+    assert len(volumes) == 2
+    assert all(volume.delete.called for volume in volumes)
+
+
+def test_wait_for_devices_survives_transient_listing_errors(manager):
+    device = mock.Mock(id='d0', state='active')
+    manager.list_devices = mock.Mock(side_effect=[packet.baseapi.Error('Error 503: unavailable'), [device]])
+    waiter = manager.wait_for_devices('project', [mock.Mock(id='d0', state='queued')])
+    assert list(waiter) == [device]
+
+    manager.list_devices = mock.Mock(side_effect=packet.baseapi.Error('Error 401: unauthorized'))
+    with pytest.raises(PacketManagerException):
+        list(manager.wait_for_devices('project', [mock.Mock(id='d0', state='queued')]))
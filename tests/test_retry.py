@@ -0,0 +1,82 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Tests for the retry policy.
+"""
+from unittest import mock
+
+import boto.exception
+import pytest
+
+from laniakea.core.retry import ErrorClass, RetryPolicy, TokenBucket
+from laniakea.core.providers.ec2.manager import classify_ec2_error
+
+
+class Flaky:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'done'
+
+
+def classify(error):
+    return {KeyError: ErrorClass.TRANSIENT, TimeoutError: ErrorClass.THROTTLED}.get(type(error), ErrorClass.FATAL)
+
+
+@pytest.fixture
+def sleep():
+    with mock.patch('time.sleep') as patched:
+        yield patched
+
+
+def test_retry_transient_errors(sleep):
+    func = Flaky(KeyError(), KeyError())
+    assert RetryPolicy(classify)(func) == 'done'
+    assert func.calls == 3
+    assert sleep.call_count == 2
+
+
+def test_fatal_errors_fail_fast(sleep):
+    func = Flaky(ValueError())
+    with pytest.raises(ValueError):
+        RetryPolicy(classify)(func)
+    assert func.calls == 1
+    assert not sleep.called
+
+
+def test_give_up_after_attempts(sleep):
+    func = Flaky(*[KeyError()] * 10)
+    with pytest.raises(KeyError):
+        RetryPolicy(classify, attempts=3)(func)
+    assert func.calls == 3
+
+
+def test_backoff_grows_and_is_bounded():
+    policy = RetryPolicy(classify, base_delay=1, throttle_delay=4, max_delay=10)
+    assert 0.5 <= policy.backoff(1, ErrorClass.TRANSIENT) <= 1
+    assert 2 <= policy.backoff(3, ErrorClass.TRANSIENT) <= 4
+    assert 2 <= policy.backoff(1, ErrorClass.THROTTLED) <= 4
+    assert policy.backoff(20, ErrorClass.THROTTLED) <= 10
+
+
+def test_throttling_pauses_shared_bucket(sleep):
+    bucket = TokenBucket(rate=100)
+    RetryPolicy(classify, throttle_delay=0.01, bucket=bucket)(Flaky(TimeoutError()))
+    assert bucket.paused_until > 0
+
+
+def test_classify_ec2_error():
+    def error(code, status=400):
+        return boto.exception.EC2ResponseError(status, code, '<Response><Errors><Error><Code>%s</Code>'
+                                                             '</Error></Errors></Response>' % code)
+    assert classify_ec2_error(error('RequestLimitExceeded', 503)) == ErrorClass.THROTTLED
+    assert classify_ec2_error(error('InvalidInstanceID.NotFound')) == ErrorClass.TRANSIENT
+    assert classify_ec2_error(error('InternalError', 500)) == ErrorClass.TRANSIENT
+    assert classify_ec2_error(error('InvalidAMIID.Malformed')) == ErrorClass.FATAL
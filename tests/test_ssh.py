@@ -0,0 +1,37 @@
+# coding: utf-8
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+Tests for the SSH executor.
+"""
+import io
+import os
+import stat
+import sys
+
+from laniakea.core.ssh import SSHExecutor
+
+FAKE_SSH = """#!%s
+import sys, time
+host, command = sys.argv[-2:]
+print('running', command)
+if host == 'slow':
+    time.sleep(10)
+sys.exit(3 if host == 'broken' else 0)
+"""
+
+
+def test_run_prefixes_output_and_summarizes(tmp_path):
+    binary = tmp_path / 'ssh'
+    binary.write_text(FAKE_SSH % sys.executable)
+    os.chmod(str(binary), stat.S_IRWXU)
+    output = io.StringIO()
+    executor = SSHExecutor('ubuntu', '~/.ssh/id', concurrency=4, timeout=2, output=output, binary=str(binary))
+
+    results = executor.run(['10.0.0.1', 'broken', 'slow'], 'uptime')
+
+    assert '[10.0.0.1] running uptime\n' in output.getvalue()
+    assert '[broken] running uptime\n' in output.getvalue()
+    assert executor.summarize(results) == {0: 1, 3: 1, None: 1}
+    assert [r.error for r in results if r.host == 'slow'] == ['Timed out after 2s']